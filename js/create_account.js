@@ -30,6 +30,7 @@ app.controller('CaCtrl', function() {
 				if (resp.result.data == 'success') {
 					// Account creation successful. Give user token and redirect to profile page.
 					localStorage.tennisJwt = resp.result.accessToken;
+					localStorage.tennisRefreshJwt = resp.result.refreshToken;
 					window.location = '/profile';
 
 				} else if (resp.result.data == 'user_exists') {
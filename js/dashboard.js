@@ -80,6 +80,8 @@ app.controller('SummaryCtrl', function(currentMatch, accessToken) {
 	summary.pendingMatchesFiltered = [];
 	summary.availableMatchesFiltered = [];
 	summary.singlesDoubles = 'singles';
+	summary.myMatchesCursor = null;  // non-null if there are more pages to load
+	summary.availableMatchesCursor = null;  // ditto
 
 	summary.showDashboard = false;
 
@@ -128,6 +130,19 @@ app.controller('SummaryCtrl', function(currentMatch, accessToken) {
 		window.location = '#/change_pw';
 	}
 
+	// Load next page of matches, on "Show more" button clicks
+	summary.loadMoreMyMatches = function() {
+		var cursor = summary.myMatchesCursor;
+		summary.myMatchesCursor = null;  // avoid double loading while request is in flight
+		loadMyMatches(accessToken.get(), cursor);
+	}
+
+	summary.loadMoreAvailableMatches = function() {
+		var cursor = summary.availableMatchesCursor;
+		summary.availableMatchesCursor = null;
+		loadAvailableMatches(accessToken.get(), cursor);
+	}
+
 	// Set access token from OAuth provider
 	summary.setAccessToken = function(token) {
 		accessToken.set(token);
@@ -267,191 +282,315 @@ app.controller('CpwCtrl', function(accessToken) {
 // User Authentication
 ///////////////////////////////////////////////////////
 
-// Show confirmed/pending/available matches for current user (only call after auth'ed)
-function showMatches(accessToken) {
-	var $scope = $('#dashboard').scope();
+// Number of matches to request from back-end per page
+var MATCHES_PAGE_SIZE = 20;
+
+// Convert MatchesMsg (see models.py for format) into an array of Match objects
+function parseMatchesMsg(matches) {
+	var num_matches = (matches.singles === undefined) ? 0 : matches.singles.length;
+	var newMatches = [];
+
+	for (var i = 0; i < num_matches; i++) {
+		newMatches.push(new Match(
+			matches.singles[i],
+			matches.date[i],
+			matches.time[i],
+			matches.location[i],
+			matches.players[i],
+			matches.confirmed[i],
+			matches.key[i]
+		));
+	}
 
-	// Get and validate URL query strings
-	var matchId = getParameterByName('match_id');
-	var validMatchId = matchId !== null && matchId !== '';
-	var matchType = getParameterByName('match_type');
+	return newMatches;
+}
 
-	// Get all matches for current user, populate Confirmed Matches and Pending Matches
-	gapi.client.tennis.getMyMatches({accessToken: accessToken}).execute(function(resp) {
-		//if (resp.result.singles === undefined) { return; }
-		// The MatchesMsg message is stored in resp.result
-		// Go through all matches in the match "list" (see models.py for format)
-		var matches = resp.result;
-		var num_matches = (resp.result.singles === undefined) ? 0 : matches.singles.length;
+// Match linked from URL query strings (e.g. from a notification), shown once it has been loaded
+var linkedMatch = {
+	id: null,
+	type: null,
+	resolved: true
+};
 
-		var confirmedMatches = [];
-		var pendingMatches = [];
+// Look for the linked match among the given matches, if it is of the given type
+// If not found and more pages exist, call loadNextPage() and look again when it returns
+function showLinkedMatch(matchType, matches, showMatch, more, loadNextPage) {
+	if (linkedMatch.resolved || linkedMatch.type !== matchType) {
+		return;
+	}
 
-		for (var i = 0; i < num_matches; i++) {
-			var newMatch = new Match(
-				matches.singles[i],
-				matches.date[i],
-				matches.time[i],
-				matches.location[i],
-				matches.players[i],
-				matches.confirmed[i],
-				matches.key[i]
-			);
-
-			if (newMatch.confirmed) {
-				confirmedMatches.push(newMatch);
-			} else {
-				pendingMatches.push(newMatch);
+	for (var i = 0; i < matches.length; i++) {
+		if (linkedMatch.id === matches[i].key) {
+			linkedMatch.resolved = true;
+			showMatch(matches[i]);
+			return;
+		}
+	}
+
+	if (more) {
+		loadNextPage();
+		return;
+	}
+
+	linkedMatch.resolved = true;
+	bootbox.dialog({
+		closeButton: false,
+		message: 'Sorry, this match is no longer available',
+		buttons: {
+			ok: {
+				label: "OK",
+				className: "btn-default"
 			}
 		}
+	});
+}
+
+// Add one page of matches (MatchesMsg) for current user to Confirmed Matches and Pending Matches
+function addMyMatches(accessToken, matchesMsg) {
+	var $scope = $('#dashboard').scope();
+
+	var newMatches = parseMatchesMsg(matchesMsg);
+	var more = matchesMsg.more === true;
+
+	var confirmedMatches = [];
+	var pendingMatches = [];
+
+	for (var i = 0; i < newMatches.length; i++) {
+		if (newMatches[i].confirmed) {
+			confirmedMatches.push(newMatches[i]);
+		} else {
+			pendingMatches.push(newMatches[i]);
+		}
+	}
+
+	// Add this page to the confirmed/pendingMatches in the controller
+	// syncChanges may have added some of these matches before their page was loaded, the page's copy replaces them
+	var pageKeys = matchKeys(newMatches);
+	$scope.$apply(function () {
+		$scope.summary.confirmedMatches = mergeMatches($scope.summary.confirmedMatches, pageKeys, confirmedMatches);
+		$scope.summary.pendingMatches = mergeMatches($scope.summary.pendingMatches, pageKeys, pendingMatches);
+		$scope.summary.myMatchesCursor = more ? matchesMsg.nextCursor : null;
+
+		$scope.summary.filterMatches();
+	});
 
-		// Point to the confirmed/pendingMatches in the controller
+	// Show one particular match
+	showLinkedMatch('conf_pend', newMatches, function(match) {
 		$scope.$apply(function () {
-			$scope.summary.confirmedMatches = confirmedMatches;
-			$scope.summary.pendingMatches = pendingMatches;
+			if (match.confirmed) {
+				$scope.summary.showConfMatch(match);
+			} else {
+				$scope.summary.showPendMatch(match);
+			}
+		});
+	}, more, function() {
+		loadMyMatches(accessToken, matchesMsg.nextCursor);
+	});
+}
+
+// Get one page of matches for current user, add it to Confirmed Matches and Pending Matches
+function loadMyMatches(accessToken, cursor) {
+	var request = {accessToken: accessToken, pageSize: MATCHES_PAGE_SIZE};
+	if (cursor) {
+		request.cursor = cursor;
+	}
+
+	gapi.client.tennis.getMyMatches(request).execute(function(resp) {
+		addMyMatches(accessToken, resp.result);
+	});
+}
+
+// Add one page of available matches (MatchesMsg) for current user to Available Matches
+function addAvailableMatches(accessToken, matchesMsg) {
+	var $scope = $('#dashboard').scope();
+
+	var newMatches = parseMatchesMsg(matchesMsg);
+	var more = matchesMsg.more === true;
+
+	// Add this page to the availableMatches in the controller
+	// syncChanges may have added some of these matches before their page was loaded, the page's copy replaces them
+	var pageKeys = matchKeys(newMatches);
+	$scope.$apply(function () {
+		$scope.summary.availableMatches = mergeMatches($scope.summary.availableMatches, pageKeys, newMatches);
+		$scope.summary.availableMatchesCursor = more ? matchesMsg.nextCursor : null;
+
+		$scope.summary.filterMatches();
+	});
 
-			$scope.summary.filterMatches();
+	// Show one particular match
+	showLinkedMatch('avail', newMatches, function(match) {
+		$scope.$apply(function () {
+			$scope.summary.showAvailMatch(match);
 		});
+	}, more, function() {
+		loadAvailableMatches(accessToken, matchesMsg.nextCursor);
+	});
+}
 
-		// Show one particular match
-		if (validMatchId && matchType === 'conf_pend') {
-			// Search for match in conf/pend match lists
-			var match_found = false;
+// Get one page of available matches for current user, add it to Available Matches
+function loadAvailableMatches(accessToken, cursor) {
+	var request = {accessToken: accessToken, pageSize: MATCHES_PAGE_SIZE};
+	if (cursor) {
+		request.cursor = cursor;
+	}
 
-			for (var i = 0; i < confirmedMatches.length; i++) {
-				var match = confirmedMatches[i];
-				if (matchId === match.key) {
-					match_found = true;
+	gapi.client.tennis.getAvailableMatches(request).execute(function(resp) {
+		addAvailableMatches(accessToken, resp.result);
+	});
+}
 
-					$scope.$apply(function () {
-						$scope.summary.showConfMatch(match);
-					});
-				}
-			}
-			for (var i = 0; i < pendingMatches.length; i++) {
-				var match = pendingMatches[i];
-				if (matchId === match.key) {
-					match_found = true;
-
-					$scope.$apply(function () {
-						$scope.summary.showPendMatch(match);
-					});
-				}
-			}
+// Show confirmed/pending/available matches for current user (only call after auth'ed)
+// The first page of each list comes with the dashboard, further pages are loaded on demand
+function showMatches(accessToken, dashboard) {
+	// Get and validate URL query strings
+	var matchId = getParameterByName('match_id');
+	linkedMatch.id = matchId;
+	linkedMatch.type = getParameterByName('match_type');
+	linkedMatch.resolved = matchId === null || matchId === '';
 
-			if (!match_found) {
-				bootbox.dialog({
-					closeButton: false,
-					message: 'Sorry, this match is no longer available',
-					buttons: {
-						ok: {
-							label: "OK",
-							className: "btn-default"
-						}
-					}
-				});
-			}
-		}
+	addMyMatches(accessToken, dashboard.myMatches || {});
+	addAvailableMatches(accessToken, dashboard.availableMatches || {});
+}
+
+// How often to ask back-end for dashboard changes, in ms
+var SYNC_INTERVAL = 60000;
+
+// Version of the dashboard the client has, see getChanges in main.py
+var syncVersion = null;
+
+// Sort matches by date and time, earliest first
+function sortMatches(matches) {
+	return matches.sort(function(a, b) {
+		// date is 'mm/dd/yyyy', time is 'HH:MM'
+		var aDateTime = a.date.slice(6) + a.date.slice(0, 5) + a.time;
+		var bDateTime = b.date.slice(6) + b.date.slice(0, 5) + b.time;
+		return aDateTime < bDateTime ? -1 : (aDateTime > bDateTime ? 1 : 0);
 	});
+}
 
-	// Query all available matches for current user, populate Available Matches
-	gapi.client.tennis.getAvailableMatches({accessToken: accessToken}).execute(function(resp) {
-		//if (resp.result.singles === undefined) { return; }
-
-		// The MatchesMsg message is stored in resp.result
-		// Go through all matches in the match "list" (see models.py for format)
-		var matches = resp.result;
-		var num_matches = (resp.result.singles === undefined) ? 0 : matches.singles.length;
-
-		var availableMatches = [];
-
-		for (var i = 0; i < num_matches; i++) {
-			var newMatch = new Match(
-				matches.singles[i],
-				matches.date[i],
-				matches.time[i],
-				matches.location[i],
-				matches.players[i],
-				matches.confirmed[i],
-				matches.key[i]
-			);
-
-			availableMatches.push(newMatch);
+// Keys of the given matches
+function matchKeys(matches) {
+	var keys = [];
+	for (var i = 0; i < matches.length; i++) {
+		keys.push(matches[i].key);
+	}
+	return keys;
+}
+
+// Drop matches whose key is in changedKeys, then add the given matches
+function mergeMatches(matches, changedKeys, added) {
+	var merged = [];
+	for (var i = 0; i < matches.length; i++) {
+		if (changedKeys.indexOf(matches[i].key) === -1) {
+			merged.push(matches[i]);
 		}
+	}
+	return sortMatches(merged.concat(added));
+}
 
-		// Point to the availableMatches in the controller
-		$scope.$apply(function () {
-			$scope.summary.availableMatches = availableMatches;
+// Ask back-end what changed since syncVersion, and apply only that to the dashboard
+function syncChanges(accessToken) {
+	var $scope = $('#dashboard').scope();
 
-			$scope.summary.filterMatches();
-		});
+	gapi.client.tennis.getChanges({accessToken: accessToken, version: syncVersion}).execute(function(resp) {
+		// Too much changed (or user's skill changed), start over
+		if (resp.result.reset) {
+			window.location.reload();
+			return;
+		}
 
-		// Show one particular match
-		if (validMatchId && matchType === 'avail') {
-			// Search for match in avail match list
-			var match_found = false;
-
-			for (var i = 0; i < availableMatches.length; i++) {
-				var match = availableMatches[i];
-				if (matchId === match.key) {
-					match_found = true;
-					$scope.$apply(function () {
-						$scope.summary.showAvailMatch(match);
-					});
-				}
-			}
+		if (resp.result.version !== undefined) {
+			syncVersion = resp.result.version;
+		}
 
-			if (!match_found) {
-				bootbox.dialog({
-					closeButton: false,
-					message: 'Sorry, this match is no longer available',
-					buttons: {
-						ok: {
-							label: "OK",
-							className: "btn-default"
-						}
-					}
-				});
+		if (!resp.result.changed) {
+			return;
+		}
+
+		var myMatches = parseMatchesMsg(resp.result.myMatches || {});
+		var availableMatches = parseMatchesMsg(resp.result.availableMatches || {});
+
+		// A changed match may move between lists (e.g. available -> pending -> confirmed),
+		// so drop every changed match from every list before adding it where it belongs now
+		var changedKeys = (resp.result.removed || []).slice();
+		var confirmedMatches = [];
+		var pendingMatches = [];
+		for (var i = 0; i < myMatches.length; i++) {
+			changedKeys.push(myMatches[i].key);
+			if (myMatches[i].confirmed) {
+				confirmedMatches.push(myMatches[i]);
+			} else {
+				pendingMatches.push(myMatches[i]);
 			}
 		}
+		for (var i = 0; i < availableMatches.length; i++) {
+			changedKeys.push(availableMatches[i].key);
+		}
+
+		$scope.$apply(function () {
+			var summary = $scope.summary;
+			summary.confirmedMatches = mergeMatches(summary.confirmedMatches, changedKeys, confirmedMatches);
+			summary.pendingMatches = mergeMatches(summary.pendingMatches, changedKeys, pendingMatches);
+			summary.availableMatches = mergeMatches(summary.availableMatches, changedKeys, availableMatches);
+
+			summary.filterMatches();
+		});
 	});
 }
 
 // Update dashboard front-end with data from back-end, after authentication is complete
-// This function is called after authentication step
-function onAuthSuccess(accessToken) {
+// 'dashboard' is the DashboardMsg from getDashboard (see models.py)
+function onAuthSuccess(accessToken, dashboard) {
 	// Get Angular scope
 	var $scope = $('#dashboard').scope();
+	var profile = dashboard.profile;
 
 	// Request match controller (ReqCtrl) needs the accessToken,
 	// since it makes back-end API call to request match for current user
 	$scope.$apply(function () { $scope.summary.setAccessToken(accessToken); });
 
-	var profile_valid = false;
+	// If user is logged-out, redirect to login page
+	// Else if user has incomplete profile, redirect to profile page
+	// Else, update greeting
+	if (!profile.loggedIn) {
+		window.location = '/login';
+	} else if (!profile.firstName || !profile.gender) {
+		window.location = '/profile';
+	} else {
+		// Show the dashboard, update greeting
+		$scope.$apply(function () {
+			$scope.summary.firstName = profile.firstName;
+			$scope.summary.emailVerified = profile.emailVerified;
+			$scope.summary.fbUser = profile.userId.slice(0,3) === 'fb_';
+			$scope.summary.showDashboard = true;
+		});
 
-	// Get Profile, update greeting on summary (if logged in)
-	gapi.client.tennis.getProfile({accessToken: accessToken}).
-		execute(function(resp) {
-			// If user is logged-out, redirect to login page
-			// Else if user has incomplete profile, redirect to profile page
-			// Else, update greeting
-			if (!resp.result.loggedIn) {
-				window.location = '/login';
-			} else if (resp.result.firstName == '' || resp.result.gender == '') {
-				window.location = '/profile';
-			} else {
-				// Show the dashboard, update greeting
-				$scope.$apply(function () {
-					$scope.summary.firstName = resp.result.firstName;
-					$scope.summary.emailVerified = resp.result.emailVerified;
-					$scope.summary.fbUser = resp.result.userId.slice(0,3) === 'fb_';
-					$scope.summary.showDashboard = true;
-				});
+		// Show match info
+		showMatches(accessToken, dashboard);
 
-				// Get and show match info
-				showMatches(accessToken);
-			}
+		// Keep access token fresh, for the sync below and any other back-end calls
+		keepAccessTokenFresh(function(newAccessToken) {
+			accessToken = newAccessToken;
+			$scope.$apply(function () { $scope.summary.setAccessToken(newAccessToken); });
 		});
+
+		// Keep it up to date, only downloading what changed
+		syncVersion = dashboard.syncVersion;
+		setInterval(function() { syncChanges(accessToken); }, SYNC_INTERVAL);
+	}
+}
+
+// Authenticate and get everything the dashboard shows, in one back-end call
+// onInvalid is called if token is invalid or user logged out of the session
+function loadDashboard(accessToken, onInvalid) {
+	gapi.client.tennis.getDashboard({accessToken: accessToken, pageSize: MATCHES_PAGE_SIZE}).execute(function(resp) {
+		if (resp.result.authenticated !== true) {
+			onInvalid();
+		} else {
+			// Token is valid and user is logged-in, proceed
+			onAuthSuccess(accessToken, resp.result);
+		}
+	});
 }
 
 // Try FB auth
@@ -461,10 +600,13 @@ function tryFb() {
 			// Authenticated
 			var accessToken = response.authResponse.accessToken;
 
-			// Remove custom account token just in case
+			// Remove custom account tokens just in case
 			localStorage.removeItem('tennisJwt');
+			localStorage.removeItem('tennisRefreshJwt');
 
-			onAuthSuccess(accessToken);
+			loadDashboard(accessToken, function() {
+				window.location = '/login';
+			});
 		} else {
 			window.location = '/login';
 		}
@@ -481,14 +623,15 @@ function onGapiLoad() {
 	if (accessToken === undefined) {
 		tryFb();
 	} else {
-		// Verify token and user login status with back-end
-		gapi.client.tennis.verifyToken({accessToken: accessToken}).execute(function(resp) {
-			if (resp.result.data === false) {
-				tryFb();
-			} else {
-				// Token is valid and user is logged-in, proceed
-				onAuthSuccess(accessToken);
-			}
+		// Access token may have expired since last visit, if so get a new one and retry
+		loadDashboard(accessToken, function() {
+			refreshAccessToken(function(newAccessToken) {
+				if (newAccessToken === undefined) {
+					tryFb();
+				} else {
+					loadDashboard(newAccessToken, tryFb);
+				}
+			});
 		});
 	}
 }
@@ -1,43 +1,63 @@
 ////////////////////////////////////////////////////////////////////
 // Get match messages
 ////////////////////////////////////////////////////////////////////
+
+// How often to poll back-end for new messages, in ms
+var MATCH_MSGS_POLL_INTERVAL = 30000;
+
+// Only messages posted after this cursor are downloaded, see getMatchMsgsSince in main.py
+var matchMsgsCursor = '';
+var matchMsgsLines = [];
+var matchMsgsTimer = null;
+
 function getMatchMsgs() {
 	var $scope = $('#dashboard').scope();
 	var accessToken = getAccessTokenGlobal();  // OAuth access token
 
-	// Get match key from front-end, get match messages from back-end
-	var matchKey = {data: $scope.match.currentMatch.key, accessToken: accessToken};
+	// Get match key from front-end, get new match messages from back-end
+	var request = {matchKey: $scope.match.currentMatch.key, cursor: matchMsgsCursor, accessToken: accessToken};
+
+	gapi.client.tennis.getMatchMsgsSince(request).execute(function(resp) {
+		if (resp.result.cursor !== undefined) {
+			matchMsgsCursor = resp.result.cursor;
+		}
 
-	gapi.client.tennis.getMatchMsgs(matchKey).execute(function(resp) {
+		// If more messages are already waiting, get them right away
+		if (resp.result.more) {
+			getMatchMsgs();
+		}
 
 		if (resp.result.data === undefined) {
-			// No messages, return
+			// No new messages, return
 			return;
 		}
-		
-		var msgs = resp.result.data;
 
-		// Text string to display all messages
-		var msgs_string = '';
+		var msgs = resp.result.data;
 
 		for (var i = 0; i < msgs.length; i++) {
 			// Parse the message (player_name|message), deal w/ extra pipes in actual msg
 			var [player_name, msg] = msgs[i].split(/\|(.+)?/);
 
-			// Build up the messages string to display
-			msgs_string += player_name + ': ' + msg;
-			if (i < msgs.length - 1) {
-				msgs_string += '\n';
-			}
+			// Build up the messages to display
+			matchMsgsLines.push(player_name + ': ' + msg);
 		}
 
 		// Show the messages
-		$('#match-msgs').text(msgs_string);
+		$('#match-msgs').text(matchMsgsLines.join('\n'));
 	});
 }
 
-// Run the above when page first loads
+// Run the above when page first loads, then poll for new messages until user leaves the page
 var $scope = $('#dashboard').scope();
 $scope.$on('$viewContentLoaded', function(event) {
+	matchMsgsCursor = '';
+	matchMsgsLines = [];
 	getMatchMsgs();
+
+	clearInterval(matchMsgsTimer);
+	matchMsgsTimer = setInterval(getMatchMsgs, MATCH_MSGS_POLL_INTERVAL);
+});
+$scope.$on('$routeChangeStart', function(event) {
+	clearInterval(matchMsgsTimer);
+	matchMsgsTimer = null;
 });
@@ -40,6 +40,7 @@ app.controller('LoginCtrl', function() {
 					// Login successful, give user token and redir to dashboard
 					try {
 						localStorage.tennisJwt = resp.result.accessToken;
+						localStorage.tennisRefreshJwt = resp.result.refreshToken;
 						window.location = '/';
 					} catch (e) {
 						alert('Your web browser does not support storing settings locally. In Safari, the most common cause of this is using "Private Browsing Mode". The user account sign-in process will not work in this case, sorry.')
@@ -60,8 +61,9 @@ function statusChangeCallback(response) {
 		// Logged into your app and Facebook.
 		var accessToken = response.authResponse.accessToken;
 
-		// Remove custom account token just in case
+		// Remove custom account tokens just in case
 		localStorage.removeItem('tennisJwt');
+		localStorage.removeItem('tennisRefreshJwt');
 
 		// Call back-end API
 		gapi.client.tennis.fbLogin({accessToken: accessToken}).execute(function(resp) {
@@ -99,6 +99,11 @@ function onAuthSuccess(accessToken) {
 				});
 
 				$('#ntrp').slider().slider('setValue', resp.result.ntrp);
+
+				// Keep access token fresh while user edits their profile
+				keepAccessTokenFresh(function(newAccessToken) {
+					$scope.$apply(function () { $scope.prof.accessToken = newAccessToken; });
+				});
 			}
 		});
 }
@@ -110,8 +115,9 @@ function tryFb() {
 			// Authenticated
 			var accessToken = response.authResponse.accessToken;
 
-			// Remove custom account token just in case
+			// Remove custom account tokens just in case
 			localStorage.removeItem('tennisJwt');
+			localStorage.removeItem('tennisRefreshJwt');
 
 			onAuthSuccess(accessToken);
 		} else {
@@ -133,7 +139,14 @@ function onGapiLoad() {
 		// Verify token and user login status with back-end
 		gapi.client.tennis.verifyToken({accessToken: accessToken}).execute(function(resp) {
 			if (resp.result.data === false) {
-				tryFb();
+				// Access token may have expired since last visit, if so get a new one
+				refreshAccessToken(function(newAccessToken) {
+					if (newAccessToken === undefined) {
+						tryFb();
+					} else {
+						onAuthSuccess(newAccessToken);
+					}
+				});
 			} else {
 				// Token is valid and user is logged-in, proceed
 				onAuthSuccess(accessToken);
@@ -28,6 +28,48 @@ window.fbAsyncInit = function() {
 	}
 };
 
+// Custom account access tokens are short-lived (see ACCESS_TOKEN_TTL in main.py),
+// so pages swap in a fresh one from the refresh token well before it expires
+var TOKEN_REFRESH_INTERVAL = 5 * 60 * 1000;  // ms
+
+function refreshAccessToken(callback) {
+	/* Get new access token using refresh token. Calls callback(accessToken), with undefined if that failed. */
+	var refreshToken = localStorage.tennisRefreshJwt;
+
+	if (refreshToken === undefined) {
+		callback(undefined);
+		return;
+	}
+
+	gapi.client.tennis.refreshToken({accessToken: refreshToken}).execute(function(resp) {
+		if (resp.result.data === 'success') {
+			localStorage.tennisJwt = resp.result.accessToken;
+			localStorage.tennisRefreshJwt = resp.result.refreshToken;
+			callback(resp.result.accessToken);
+		} else {
+			// Session is over, e.g. user logged out elsewhere
+			localStorage.removeItem('tennisJwt');
+			localStorage.removeItem('tennisRefreshJwt');
+			callback(undefined);
+		}
+	});
+}
+
+function keepAccessTokenFresh(onRefresh) {
+	/* Periodically refresh custom account access token, calling onRefresh(accessToken) with each new one */
+	if (localStorage.tennisRefreshJwt === undefined) {
+		return;  // FB user, or legacy token that never expires
+	}
+
+	setInterval(function() {
+		refreshAccessToken(function(accessToken) {
+			if (accessToken !== undefined) {
+				onRefresh(accessToken);
+			}
+		});
+	}, TOKEN_REFRESH_INTERVAL);
+}
+
 function getAccessTokenGlobal() {
 	/* Get valid access token from localStorage or FB. If invalid, redirect to login page. */
 	var accessToken = localStorage.tennisJwt;
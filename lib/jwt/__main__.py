@@ -3,11 +3,94 @@
 from __future__ import absolute_import, print_function
 
 import json
+import multiprocessing
 import optparse
 import sys
 import time
 
-from . import DecodeError, __package__, __version__, decode, encode
+from . import (
+    DecodeError, PyJWTVerifier, __package__, __version__, decode, encode
+)
+
+# Lines handed to each worker process at a time in batch mode
+BATCH_CHUNK_SIZE = 64
+
+# Per-process batch settings, see _init_batch
+_batch = {}
+
+
+def _init_batch(mode, key, algorithm, verify):
+    _batch['mode'] = mode
+    _batch['key'] = key
+    _batch['algorithm'] = algorithm
+    _batch['verify'] = verify
+
+    # Prepare the key once per process, not once per token
+    if mode == 'decode' and verify:
+        _batch['verifier'] = PyJWTVerifier(key, algorithms=[algorithm])
+
+
+def _batch_line(item):
+    """
+    Encode or decode one line of batch input.
+    Returns (ok, JSON result line), errors are reported instead of raised.
+    """
+    lineno, line = item
+    result = {'line': lineno}
+
+    try:
+        if _batch['mode'] == 'decode':
+            if _batch['verify']:
+                result['payload'] = _batch['verifier'].decode(line)
+            else:
+                result['payload'] = decode(line, verify=False)
+        else:
+            payload = json.loads(line)
+
+            # exp +offset special case, same as single token encoding
+            exp = payload.get('exp') if isinstance(payload, dict) else None
+            if isinstance(exp, type(u'')) and exp[:1] == '+' and len(exp) > 1:
+                payload['exp'] = int(time.time() + int(exp[1:]))
+
+            token = encode(payload, key=_batch['key'],
+                           algorithm=_batch['algorithm'])
+            result['token'] = token.decode('utf-8')
+    except Exception as e:
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+        return False, json.dumps(result)
+
+    return True, json.dumps(result)
+
+
+def batch(mode, options):
+    """
+    Encode or decode newline-delimited input from stdin, one JSON result line
+    per input line on stdout, in input order. Blank lines are skipped.
+    Exits 1 if any line failed, after processing all of them.
+    """
+    lines = ((lineno, line.strip()) for lineno, line in enumerate(sys.stdin, 1)
+             if line.strip())
+    init_args = (mode, options.key, options.algorithm, options.verify)
+
+    pool = None
+    if options.workers > 1:
+        pool = multiprocessing.Pool(options.workers, _init_batch, init_args)
+        results = pool.imap(_batch_line, lines, BATCH_CHUNK_SIZE)
+    else:
+        _init_batch(*init_args)
+        results = (_batch_line(item) for item in lines)
+
+    failed = 0
+    for ok, output in results:
+        if not ok:
+            failed += 1
+        print(output)
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    sys.exit(1 if failed else 0)
 
 
 def main():
@@ -27,7 +110,14 @@ separated by equals (=) as input. Examples:
   %prog --key=secret iss=me exp=1302049071
   %prog --key=secret foo=bar exp=+10
 
-The exp key is special and can take an offset to current Unix time.\
+The exp key is special and can take an offset to current Unix time.
+
+Batch mode reads one token (decode) or one JSON object of claims (encode)
+per line from stdin, and writes one JSON result per line to stdout, with
+either a payload, token, or error. Examples:
+
+  %prog --batch=decode --key=secret < tokens.txt
+  %prog --batch=encode --key=secret --workers=4 < claims.jsonl\
 '''
     p = optparse.OptionParser(
         usage=usage,
@@ -59,8 +149,35 @@ The exp key is special and can take an offset to current Unix time.\
         help='set crypto algorithm to sign with. default=HS256'
     )
 
+    p.add_option(
+        '--batch',
+        dest='batch',
+        metavar='MODE',
+        choices=['encode', 'decode'],
+        default=None,
+        help='encode or decode each line of stdin, see usage above'
+    )
+
+    p.add_option(
+        '--workers',
+        dest='workers',
+        metavar='N',
+        type='int',
+        default=1,
+        help='number of worker processes in batch mode. default=1'
+    )
+
     options, arguments = p.parse_args()
 
+    if options.batch:
+        if options.key is None and (options.batch == 'encode' or
+                                    options.verify):
+            print('Key is required in batch mode, unless decoding with '
+                  '--no-verify. See --help for usage.')
+            sys.exit(1)
+
+        batch(options.batch, options)
+
     if len(arguments) > 0 or not sys.stdin.isatty():
         if len(arguments) == 1 and (not options.verify or options.key):
             # Try to decode
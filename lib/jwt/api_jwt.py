@@ -10,7 +10,7 @@ from .algorithms import Algorithm, get_default_algorithms  # NOQA
 from .compat import string_types, timedelta_total_seconds
 from .exceptions import (
     DecodeError, ExpiredSignatureError, ImmatureSignatureError,
-    InvalidAudienceError, InvalidIssuedAtError,
+    InvalidAlgorithmError, InvalidAudienceError, InvalidIssuedAtError,
     InvalidIssuerError, MissingRequiredClaimError
 )
 from .utils import merge_dict
@@ -58,11 +58,18 @@ class PyJWT(PyJWS):
 
     def decode(self, jwt, key='', verify=True, algorithms=None, options=None,
                **kwargs):
-        payload, signing_input, header, signature = self._load(jwt)
-
         decoded = super(PyJWT, self).decode(jwt, key, verify, algorithms,
                                             options, **kwargs)
 
+        payload = self._load_payload(decoded)
+
+        if verify:
+            merged_options = merge_dict(self.options, options)
+            self._validate_claims(payload, merged_options, **kwargs)
+
+        return payload
+
+    def _load_payload(self, decoded):
         try:
             payload = json.loads(decoded.decode('utf-8'))
         except ValueError as e:
@@ -70,10 +77,6 @@ class PyJWT(PyJWS):
         if not isinstance(payload, Mapping):
             raise DecodeError('Invalid payload string: must be a json object')
 
-        if verify:
-            merged_options = merge_dict(self.options, options)
-            self._validate_claims(payload, merged_options, **kwargs)
-
         return payload
 
     def _validate_claims(self, payload, options, audience=None, issuer=None,
@@ -179,6 +182,58 @@ class PyJWT(PyJWS):
             raise InvalidIssuerError('Invalid issuer')
 
 
+class PyJWTVerifier(PyJWT):
+    """
+    Verifies tokens against a key, algorithms and options fixed up front.
+
+    The key is prepared for each allowed algorithm and the options are merged
+    once, at construction. decode() then splits, base64-decodes and parses each
+    token in a single pass. Use one instance per key, e.g. at module level.
+    """
+
+    def __init__(self, key, algorithms, options=None, audience=None,
+                 issuer=None, leeway=0):
+        if not algorithms:
+            raise ValueError('Expecting a list of allowed algorithms.')
+
+        super(PyJWTVerifier, self).__init__(algorithms=algorithms,
+                                            options=options)
+
+        # Prepared key for each allowed algorithm, by alg header value
+        self._prepared = {}
+        for alg in algorithms:
+            try:
+                alg_obj = self._algorithms[alg]
+            except KeyError:
+                raise NotImplementedError('Algorithm not supported')
+
+            self._prepared[alg] = (alg_obj, alg_obj.prepare_key(key))
+
+        self._claim_kwargs = {
+            'audience': audience,
+            'issuer': issuer,
+            'leeway': leeway
+        }
+
+    def decode(self, jwt):
+        payload, signing_input, header, signature = self._load(jwt)
+
+        if self.options.get('verify_signature'):
+            try:
+                alg_obj, key = self._prepared[header.get('alg')]
+            except KeyError:
+                raise InvalidAlgorithmError(
+                    'The specified alg value is not allowed')
+
+            if not alg_obj.verify(signing_input, key, signature):
+                raise DecodeError('Signature verification failed')
+
+        payload = self._load_payload(payload)
+        self._validate_claims(payload, self.options, **self._claim_kwargs)
+
+        return payload
+
+
 _jwt_global_obj = PyJWT()
 encode = _jwt_global_obj.encode
 decode = _jwt_global_obj.decode
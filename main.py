@@ -2,31 +2,61 @@
 The API backend
 '''
 
+import collections
 from datetime import datetime
 from datetime import timedelta
 from eastern_tzinfo import Eastern_tzinfo
+import hashlib
+import heapq
+import httplib
 import json
+import logging
 import os
+import threading
+import time
 from django.utils.http import urlquote
 import Crypto.Random
-from Crypto.Protocol import KDF
 import jwt
+import open_matches
+import passwords
 
 import endpoints
+import webapp2
 from protorpc import messages
 from protorpc import message_types
 from protorpc import remote
 
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 from google.appengine.api import urlfetch
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 
 from models import Profile
+from models import Auth
+from models import RevokedSession
+from models import PlayerCard
 from models import ProfileMsg
 from models import AccountAuthMsg
+from models import AuthTokenMsg
 from models import ChangePasswordMsg
 from models import Match
+from models import normalizeSkill
+from models import skillBand
+from models import PlayerMatch
+from models import AvailableMatch
+from models import Outbox
+from models import MatchMessage
+from models import MatchMsgsPageMsg
+from models import MatchMsgsMsg
+from models import DashboardMsg
+from models import MatchChange
+from models import SyncVersionMsg
+from models import ChangesMsg
 from models import MatchMsg
 from models import MatchesMsg
+from models import MatchesPageMsg
+from models import RecommendMatchesMsg
 from models import AccessTokenMsg
 from models import StringMsg
 from models import BooleanMsg
@@ -44,10 +74,101 @@ from settings import GRECAPTCHA_SECRET
 #from settings import WEB_CLIENT_ID
 # SparkPost
 from settings import SPARKPOST_SECRET
+from settings import SPARKPOST_API_URL
+from settings import SPARKPOST_BATCH_SIZE
+# Match-making
+from settings import SKILL_TOLERANCE
+from settings import AVAILABLE_MATCHES_INBOX
+# Dashboard delta sync
+from settings import SYNC_RETENTION
+from settings import RECOMMEND_SKILL_WEIGHT
+from settings import RECOMMEND_TIME_WEIGHT
+from settings import RECOMMEND_TYPE_WEIGHT
+from settings import RECOMMEND_FULLNESS_WEIGHT
+from settings import RECOMMEND_TIME_SCALE
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 
+# Pagination of match lists
+MATCHES_PAGE_SIZE = 20  # default number of matches per page
+MAX_MATCHES_PAGE_SIZE = 100
+PAGE_CURSOR_DT_FORMAT = '%Y%m%d%H%M%S%f'  # dateTime cutoff carried in page cursors, see TennisApi._pageCursor
+MATCH_MSGS_PAGE_SIZE = 100  # match chat messages returned per getMatchMsgsSince call
+MATCH_MSGS_START_CURSOR = 'start'  # cursor once legacy messages are sent but no MatchMessage was read yet
+
+# Matches a user just created or joined, merged into their first page until the PlayerMatch query catches up
+RECENT_MATCHES_KEY = 'recent_matches:%s'  # memcache, list of urlsafe Match keys per userId
+RECENT_MATCHES_TTL = 60  # seconds, well past the usual lag of non-ancestor queries
+
+# Available match notifications are fanned out by push queue tasks, see queue.yaml
+NOTIFY_QUEUE = 'notifications'
+NOTIFY_BATCH_SIZE = 50  # potential partners notified per task
+RETRACT_BATCH_SIZE = 500  # AvailableMatch inbox entries deleted per task, see RetractAvailMatchHandler
+
+# FB app access token, cached per instance and in memcache
+FB_APP_TOKEN_KEY = 'fb_app_token'
+FB_APP_TOKEN_TTL = 60 * 60  # seconds, unless FB says it expires sooner
+_fb_app_token = {'token': None, 'expires': 0}
+
+# FB user token -> userId, cached per instance (bounded LRU) and in memcache
+# Keyed by hash of the token, so tokens themselves are never stored
+FB_USER_ID_KEY = 'fb_user_id:%s'
+FB_USER_ID_TTL = 5 * 60  # seconds, never longer than the token itself is valid
+FB_USER_ID_CACHE_SIZE = 1000
+_fb_user_ids = collections.OrderedDict()  # token hash -> (userId, expires)
+_fb_user_ids_lock = threading.Lock()  # app is threadsafe, and concurrent updates can corrupt an OrderedDict
+
+# Dashboard delta sync, see TennisApi.getChanges
+# Versions are microseconds since epoch, tokens handed to clients are 'skill band:version'
+SYNC_VERSION_KEY = 'sync_version:%s'  # memcache, latest change version per scope
+SYNC_VERSION_TTL = 30  # seconds
+SYNC_SKEW = 5 * 1000000  # re-send changes this close to the client's version, covers clock skew between instances
+SYNC_MAX_CHANGES = 200  # more changes than this, and the client reloads instead
+
+# Match reminders, one ETA task per confirmed match, see TennisApi._queueReminder
+REMINDER_QUEUE = 'reminders'
+REMINDER_LEAD = timedelta(hours=12)  # reminders go out this long before the match
+REMINDER_MAX_ETA = timedelta(days=29)  # task ETAs can't be more than 30 days out, so farther reminders hop
+
+# One-time move of Profile.matches lists to PlayerMatch entities, see MigratePlayerMatchesHandler
+MIGRATE_PLAYER_MATCHES_URL = '/tasks/migrate_player_matches'
+MIGRATE_BATCH_SIZE = 100  # profiles per task
+
+# One-time re-put of entities, so computed properties added since they were written get indexed, see ReputHandler
+REPUT_URL = '/tasks/reput'
+REPUT_BATCH_SIZE = 100  # entities per task
+REPUT_KINDS = {'Match': Match, 'Profile': Profile}
+
+# Custom account tokens, see TennisApi._genTokens
+ACCESS_TOKEN_TTL = 15 * 60  # seconds, access tokens are checked by signature, expiry and revocation list only
+REFRESH_TOKEN_TTL = 30 * 24 * 60 * 60  # seconds, refresh tokens are checked against Auth when used
+REVOKED_KEY = 'revoked_sessions'  # memcache, dict of session_id -> expires of recently revoked sessions
+REVOKED_CACHE_TTL = 10  # seconds an instance trusts its own copy of the revocation list
+REVOKED_MEMCACHE_TTL = 60  # seconds, then the list is reloaded from datastore in case memcache lost an update
+_revoked = {'sessions': {}, 'loaded': 0}
+
+# Page cursors into the open match index have this prefix, other cursors are datastore cursors, see open_matches.py
+OPEN_MATCHES_CURSOR = 'idx:'
+
+# Match recommendations, scoring weights are in settings.py, see TennisApi.getRecommendedMatches
+RECOMMEND_MAX_CANDIDATES = 1000  # most open matches scored per request, earliest first
+RECOMMEND_QUERY_BATCH = 100  # matches per datastore round trip while streaming candidates
+
+# PlayerCards, cached in memcache by userId, see TennisApi._getCards
+PLAYER_CARD_KEY = 'player_card:%s'
+PLAYER_CARD_TTL = 10 * 60  # seconds, bounds staleness if an invalidation races a refill
+
+# Verifies custom account tokens, key prepared once per instance, see TennisApi._decodeToken
+_ca_token_verifier = jwt.PyJWTVerifier(CA_SECRET, algorithms=['HS256'])
+
+# Side effects that may be written to the Outbox, see TennisApi._dispatchOutbox
+OUTBOX_METHODS = ('_postFbNotif', '_emailMatchUpdate', '_emailVerif')
+
+# Returned when the instance is too busy hashing passwords, see passwords.BusyError
+class ServiceUnavailableException(endpoints.ServiceException):
+	http_status = httplib.SERVICE_UNAVAILABLE
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 @endpoints.api( name='tennis',
@@ -61,35 +182,85 @@ class TennisApi(remote.Service):
 	# Email Management
 	###################################################################
 
-	def _postToSparkpost(self, payload):
-		""" Post to Sparkpost API. Return True/False status """
+	def _sparkpostTransmit(self, payload):
+		""" POST transmission to Sparkpost API. Return decoded JSON response. """
 		payload_json = json.dumps(payload)
 		headers = {
 			'Authorization': SPARKPOST_SECRET,
 			'Content-Type': 'application/json',
 		}
 
-		url = 'https://api.sparkpost.com/api/v1/transmissions?num_rcpt_errors=3'
+		# Ask for an error entry per rejected recipient
+		url = '%s/transmissions?num_rcpt_errors=%d' % (SPARKPOST_API_URL, max(3, len(payload['recipients'])))
 		try:
 			result = urlfetch.Fetch(url, headers=headers, payload=payload_json, method=2)
 		except:
 			raise endpoints.BadRequestException('urlfetch error: Unable to POST to SparkPost')
-			return False
-		data = json.loads(result.content)
+		return json.loads(result.content)
+
+	def _postToSparkpost(self, payload):
+		""" Post to Sparkpost API. Return True/False status """
+		data = self._sparkpostTransmit(payload)
 
 		# Determine status from SparkPost, return True/False
 		if 'errors' in data:
 			return False
-		if data['results']['total_accepted_recipients'] != 1:
+		if data['results']['total_accepted_recipients'] != len(payload['recipients']):
 			return False
 
 		return True
 
-	def _emailVerif(self, profile):
-		""" Send verification email, given reference to Profile object. Return success True/False. """
+	def _postToSparkpostBulk(self, recipients, template_id, substitution_data):
+		"""
+		Send a SparkPost template to many recipients, at most SPARKPOST_BATCH_SIZE per transmission
+		'substitution_data' is shared by all recipients, each recipient may add its own
+		Returns list of (email, reason) for recipients that were not accepted. email is None
+		if SparkPost rejected a recipient without saying which one.
+		"""
+		failures = []
+
+		for i in range(0, len(recipients), SPARKPOST_BATCH_SIZE):
+			batch = recipients[i:i + SPARKPOST_BATCH_SIZE]
+			payload = {
+				'recipients': batch,
+				'content': {
+					'template_id': template_id,
+				},
+				'substitution_data': substitution_data,
+			}
+
+			# A failed transmission fails every recipient in it, but not the other batches
+			try:
+				data = self._sparkpostTransmit(payload)
+			except endpoints.BadRequestException as e:
+				failures += [(r['address']['email'], str(e)) for r in batch]
+				continue
+
+			if 'errors' in data:
+				reason = '; '.join(error.get('message', '') for error in data['errors'])
+				failures += [(r['address']['email'], reason) for r in batch]
+				continue
+
+			# Some recipients rejected, match each error to its address where SparkPost names it
+			for error in data['results'].get('rcpt_to_errors', []):
+				reason = error.get('description') or error.get('message', '')
+				email = None
+				for r in batch:
+					if r['address']['email'] in reason:
+						email = r['address']['email']
+						break
+				failures.append((email, reason))
+
+		for email, reason in failures:
+			logging.warning('SparkPost rejected %s: %s', email, reason)
+
+		return failures
+
+	def _emailVerif(self, user_id, email, first_name, last_name):
+		""" Send verification email, given user's Profile fields. Return success True/False. """
 		# Generate JWT w/ payload of userId and email, secret is EMAIL_VERIF_SECRET
 		token = jwt.encode(
-			{'userId': profile.userId, 'contactEmail': profile.contactEmail},
+			{'userId': user_id, 'contactEmail': email},
 			EMAIL_VERIF_SECRET,
 			algorithm='HS256'
 		)
@@ -98,11 +269,11 @@ class TennisApi(remote.Service):
 		payload = {
 			'recipients': [{
 				'address': {
-					'email': profile.contactEmail,
-					'name': profile.firstName + ' ' + profile.lastName,
+					'email': email,
+					'name': first_name + ' ' + last_name,
 				},
 				'substitution_data': {
-					'first_name': profile.firstName,
+					'first_name': first_name,
 					'token':      token,
 				},
 			}],
@@ -144,7 +315,8 @@ class TennisApi(remote.Service):
 			return False
 
 		# Generate JWT to reset password, expires 30 minutes from now
-		token = jwt.encode({'userId': profile.userId, 'exp': datetime.now() + timedelta(minutes=30)}, CA_SECRET, algorithm='HS256')
+		# Typed, so resetPassword can tell it from access and refresh tokens signed with the same secret
+		token = jwt.encode({'userId': profile.userId, 'typ': 'reset', 'exp': datetime.now() + timedelta(minutes=30)}, CA_SECRET, algorithm='HS256')
 
 		# Create SparkPost request to send pw reset email
 		payload = {
@@ -165,71 +337,190 @@ class TennisApi(remote.Service):
 
 		return self._postToSparkpost(payload)
 
-	def _emailMatchUpdate(self, user_id, message, person, action):
-		"""
-		Send match update email to user, via match-update SparkPost template
-		Given user, message content, person-of-interest, action (e.g. joined/left)
-		"""
-		# Get profile of user_id
-		profile_key = ndb.Key(Profile, user_id)
-		profile = profile_key.get()
-
-		# If user disabled email notifications or email is unverified, return
-		if not profile.notifications[1] or not profile.emailVerified:
-			return False
+	def _notifRecipients(self, profiles):
+		""" Build SparkPost recipients from Profiles or PlayerCards, skipping users who disabled email notifications or are unverified """
+		recipients = []
+		for profile in profiles:
+			if profile is None or not profile.notifications[1] or not profile.emailVerified:
+				continue
 
-		# Create SparkPost request to send notification email
-		payload = {
-			'recipients': [{
+			recipients.append({
 				'address': {
 					'email': profile.contactEmail,
 					'name': profile.firstName + ' ' + profile.lastName,
 				},
 				'substitution_data': {
 					'first_name': profile.firstName,
-					'message':    message,
-					'person':     person,
-					'action':     action,
 				},
-			}],
-			'content': {
-				'template_id': 'match-update',
-			},
-		}
+			})
+		return recipients
 
-		return self._postToSparkpost(payload)
+	def _emailMatchUpdate(self, user_ids, message, person, action):
+		"""
+		Send match update email to users, via match-update SparkPost template
+		Given list of userIds, message content, person-of-interest, action (e.g. joined/left)
+		Returns list of (email, reason) failures, see _postToSparkpostBulk
+		"""
+		# Get cards of all user_ids at once
+		recipients = self._notifRecipients(self._getCards(user_ids))
+		if not recipients:
+			return []
+
+		return self._postToSparkpostBulk(recipients, 'match-update', {
+			'message': message,
+			'person':  person,
+			'action':  action,
+		})
+
+	def _emailMatchReminder(self, user_ids, message, location, dt_string):
+		"""
+		Send reminder email of an upcoming match to its players, via match-reminder SparkPost template
+		Given list of userIds, message content, match location and 'on <date> at <time>' string
+		Returns list of (email, reason) failures, see _postToSparkpostBulk
+		"""
+		recipients = self._notifRecipients(self._getCards(user_ids))
+		if not recipients:
+			return []
+
+		return self._postToSparkpostBulk(recipients, 'match-reminder', {
+			'message':   message,
+			'location':  location,
+			'date_time': dt_string,
+		})
 
-	def _emailAvailMatch(self, partner, message, player_name):
+	def _emailAvailMatch(self, partners, message, player_name):
 		"""
-		Send notification to potential parter of a newly created match
-		'partner' is the person to send the email to, a Profile object
+		Send notification to potential parters of a newly created match
+		'partners' are the people to send the email to, a list of Profile objects
 		'player_name' is the name of the person who created the match, a string
+		Returns list of (email, reason) failures, see _postToSparkpostBulk
 		"""
-		profile = partner
+		recipients = self._notifRecipients(partners)
+		if not recipients:
+			return []
 
-		# If user disabled email notifications or email is unverified, return
-		if not profile.notifications[1] or not profile.emailVerified:
-			return False
+		return self._postToSparkpostBulk(recipients, 'available-match-notification', {
+			'message': message,
+			'person':  player_name,
+		})
 
-		# Create SparkPost request to send notification email
-		payload = {
-			'recipients': [{
-				'address': {
-					'email': profile.contactEmail,
-					'name': profile.firstName + ' ' + profile.lastName,
-				},
-				'substitution_data': {
-					'first_name': profile.firstName,
-					'message':    message,
-					'person':     player_name,
-				},
-			}],
-			'content': {
-				'template_id': 'available-match-notification',
-			},
-		}
 
-		return self._postToSparkpost(payload)
+	###################################################################
+	# Outbox
+	###################################################################
+
+	def _writeOutbox(self, effects):
+		"""
+		Write side effects to a new Outbox entity, call inside a transaction
+		Each effect is [method name, [args]], method name from OUTBOX_METHODS.
+		The effects are dispatched by a task that only runs once the transaction commits,
+		so transactions stay short and a retried transaction can't send anything twice.
+		"""
+		if not effects:
+			return
+
+		outbox_key = Outbox(effects=effects).put()
+		taskqueue.add(queue_name=NOTIFY_QUEUE, url='/tasks/dispatch_outbox',
+			params={'key': outbox_key.urlsafe()}, transactional=True)
+
+	def _dispatchOutbox(self, outbox_key):
+		"""
+		Run the side effects in an Outbox, in order, then delete it
+		Progress is checkpointed after every effect, so a retried dispatch resumes where it stopped
+		"""
+		outbox = outbox_key.get()
+		if outbox is None:
+			return  # already fully dispatched
+
+		while outbox.done < len(outbox.effects):
+			method, args = outbox.effects[outbox.done]
+
+			# A failed notification is logged, not retried, since it may have partly gone out
+			try:
+				if method not in OUTBOX_METHODS:
+					raise ValueError('Unknown outbox method %s' % method)
+				getattr(self, method)(*args)
+			except Exception:
+				logging.exception('Outbox %s: %s%r failed', outbox_key.id(), method, tuple(args))
+
+			outbox.done += 1
+			outbox.put()
+
+		outbox_key.delete()
+
+
+	###################################################################
+	# Match Reminders
+	###################################################################
+
+	def _reminderEta(self, match):
+		""" Return time the match's reminder is due, as timezone-aware datetime """
+		# Match.dateTime is naive local time, see _localNow
+		return (match.dateTime - REMINDER_LEAD).replace(tzinfo=Eastern_tzinfo())
+
+	def _queueReminder(self, match, match_key):
+		"""
+		Schedule a reminder task for a newly confirmed match, call inside the transaction that confirms it
+		Caller must put() the match. Each reminder gets a fresh Match.reminderId, which the task
+		checks before sending, so clearing or replacing it cancels or reschedules the reminder.
+		"""
+		match.reminderId = os.urandom(8).encode('hex')
+		self._addReminderTask(match_key, match.reminderId, self._reminderEta(match), transactional=True)
+
+	def _addReminderTask(self, match_key, reminder_id, eta, transactional=False):
+		""" Enqueue reminder task, ETA capped at REMINDER_MAX_ETA (the task re-enqueues itself until due) """
+		eta = min(eta, datetime.now(Eastern_tzinfo()) + REMINDER_MAX_ETA)
+		taskqueue.add(queue_name=REMINDER_QUEUE, url='/tasks/match_reminder', eta=eta,
+			params={'match_key': match_key, 'reminder_id': reminder_id}, transactional=transactional)
+
+	@ndb.transactional
+	def _claimReminder(self, match_key, reminder_id):
+		"""
+		Return Match if its reminder reminder_id is still due to be sent, clearing it so it's sent at most once
+		Returns None if the match or reminder was cancelled, or the reminder was already sent
+		"""
+		match = ndb.Key(urlsafe=match_key).get()
+		if match is None or not match.confirmed or match.reminderId != reminder_id:
+			return None
+
+		match.reminderId = None
+		match.put()
+		return match
+
+	def _sendReminder(self, match_key, reminder_id):
+		""" Remind all players of an upcoming confirmed match, unless the reminder was cancelled """
+		match = ndb.Key(urlsafe=match_key).get()
+		if match is None or not match.confirmed or match.reminderId != reminder_id:
+			return
+
+		# Reminder is farther out than a task ETA can be, wait some more
+		eta = self._reminderEta(match)
+		if eta > datetime.now(Eastern_tzinfo()):
+			self._addReminderTask(match_key, reminder_id, eta)
+			return
+
+		# Match confirmed too late for a reminder to be useful, or already played
+		if not self._isUpcoming(match, 0):
+			return
+
+		match = self._claimReminder(match_key, reminder_id)
+		if match is None:
+			return
+
+		dt_string = match.dateTime.strftime('on %m/%d/%Y at %H:%M')
+		message = 'Reminder: your match at %s is %s' % (match.location, dt_string)
+
+		match_url = '?match_type=conf_pend&match_id=' + match_key
+		email_message = '%s. To view your match, <a href="http://www.georgesungtennis.com/%s">click here</a>.' % (message, match_url)
+
+		# The functions themselves will test if FB user and/or if they enabled the notification
+		for player in match.players:
+			try:
+				self._postFbNotif(player, urlquote(message), match_url)
+			except Exception:
+				logging.exception('Unable to send FB reminder to %s of match %s', player, match_key)
+
+		self._emailMatchReminder(list(match.players), email_message, match.location, dt_string)
 
 
 	@endpoints.method(AccessTokenMsg, StringMsg, path='',
@@ -258,7 +549,8 @@ class TennisApi(remote.Service):
 
 		# If we get here then email is verified. Update DB and return successful status
 		profile.emailVerified = True
-		profile.put()
+		ndb.put_multi([profile, self._playerCard(profile)])
+		self._uncacheCards([user_id])
 
 		status.data = email
 		return status
@@ -274,13 +566,121 @@ class TennisApi(remote.Service):
 		return jwt.encode(payload, secret, algorithm='HS256')
 
 	def _decodeToken(self, token):
-		""" Decode custom token. If successful, return payload. Else, return None. """
-		secret = CA_SECRET
+		"""
+		Decode custom token. If successful, return payload. Else, return None.
+		Expiry is checked by the verifier. Refresh and password reset tokens, and tokens of revoked sessions, are rejected.
+		"""
 		try:
-			return jwt.decode(token, secret, algorithm='HS256')
+			payload = _ca_token_verifier.decode(token)
 		except:
 			return None
 
+		if payload.get('typ') in ('refresh', 'reset') or payload.get('session_id') in self._revokedSessions():
+			return None
+		return payload
+
+	def _genTokens(self, user_id, session_id):
+		"""
+		Generate (access token, refresh token) for a custom account session
+		Access tokens are short-lived and checked without touching datastore, see _decodeToken.
+		Refresh tokens are long-lived, and only accepted while the session is still current in Auth.
+		"""
+		now = int(time.time())
+		access_token = self._genToken({'userId': user_id, 'session_id': session_id, 'typ': 'access', 'exp': now + ACCESS_TOKEN_TTL})
+		refresh_token = self._genToken({'userId': user_id, 'session_id': session_id, 'typ': 'refresh', 'exp': now + REFRESH_TOKEN_TTL})
+		return access_token, refresh_token
+
+	def _revokedSessions(self):
+		""" Return dict of session_id -> expires of revoked sessions, cached per instance and in memcache """
+		now = time.time()
+		if _revoked['loaded'] + REVOKED_CACHE_TTL > now:
+			return _revoked['sessions']
+
+		sessions = memcache.get(REVOKED_KEY)
+		if sessions is None:
+			# Only sessions whose access tokens may still be unexpired are listed, so the list stays small
+			query = RevokedSession.query(RevokedSession.expires > int(now))
+			sessions = {revoked.key.id(): revoked.expires for revoked in query}
+			memcache.set(REVOKED_KEY, sessions, time=REVOKED_MEMCACHE_TTL)
+
+		_revoked['sessions'] = {session_id: expires for session_id, expires in sessions.items() if expires > now}
+		_revoked['loaded'] = now
+		return _revoked['sessions']
+
+	def _revokeSession(self, session_id):
+		""" Reject access tokens of session from now on, on every instance within REVOKED_CACHE_TTL """
+		if not session_id or session_id == 'invalid':
+			return
+
+		expires = int(time.time()) + ACCESS_TOKEN_TTL
+		RevokedSession(id=session_id, expires=expires).put()
+
+		# Add it to the memcache list too, the datastore query behind it is eventually consistent
+		client = memcache.Client()
+		for _ in range(10):
+			sessions = client.gets(REVOKED_KEY)
+			if sessions is None:
+				break  # next reader loads the list from datastore
+			sessions[session_id] = expires
+			if client.cas(REVOKED_KEY, sessions, time=REVOKED_MEMCACHE_TTL):
+				break
+
+		_revoked['sessions'][session_id] = expires
+
+	def _newSession(self, auth):
+		""" Start a new session for auth, revoking its current one. Caller must put() auth. Return session_id. """
+		self._revokeSession(auth.session_id)
+		auth.session_id = Crypto.Random.new().read(16).encode('hex')
+		return auth.session_id
+
+	def _hashPassword(self, password):
+		""" Return versioned salted hash of password, see passwords.py """
+		try:
+			return passwords.hashPassword(password)
+		except passwords.BusyError:
+			raise ServiceUnavailableException('Server busy, please try again')
+
+	def _verifyPassword(self, password, salt_passkey):
+		""" Return True if password matches stored salt_passkey hash, see passwords.py """
+		try:
+			return passwords.verifyPassword(password, salt_passkey)
+		except passwords.BusyError:
+			raise ServiceUnavailableException('Server busy, please try again')
+
+	def _getAuth(self, user_id):
+		"""
+		Get user's Auth, or None if no such user
+		Users from before Auth existed have their credentials moved over from Profile on first use
+		"""
+		auth = ndb.Key(Auth, user_id).get()
+		if auth is not None:
+			return auth
+
+		profile = ndb.Key(Profile, user_id).get()
+		if profile is None:
+			return None
+
+		# Transactional insert, so a login or logout that wrote Auth meanwhile isn't overwritten
+		return Auth.get_or_insert(
+			user_id,
+			salt_passkey = profile.salt_passkey,
+			session_id = profile.session_id,
+			loggedIn = profile.loggedIn
+		)
+
+	def _checkSession(self, ca_payload):
+		""" Return True if custom token payload (from _decodeToken) is for a logged-in session """
+		if 'userId' not in ca_payload or 'session_id' not in ca_payload:
+			return False
+
+		# Access tokens were already checked by signature, expiry and revocation list
+		if ca_payload.get('typ') == 'access':
+			return True
+
+		# Legacy tokens never expire, so check them against the session store
+		auth = self._getAuth(ca_payload['userId'])
+		return auth is not None and auth.loggedIn and auth.session_id == ca_payload['session_id']
+
 	def _getUserId(self, token):
 		""" Get userId: First check if local account, then check if FB account """
 		# See if token belongs to custom account user
@@ -299,25 +699,44 @@ class TennisApi(remote.Service):
 		status = BooleanMsg()  # return status
 		status.data = False  # default to invalid (False)
 
+		# Check if user is logged into valid session
 		ca_payload = self._decodeToken(request.accessToken)
 		if ca_payload is not None:
-			if 'userId' in ca_payload and 'session_id' in ca_payload:
-				# Check if user is logged into valid session
-				user_id = ca_payload['userId']
-				session_id = ca_payload['session_id']
+			status.data = self._checkSession(ca_payload)
+
+		return status
+
+	@endpoints.method(AccessTokenMsg, AuthTokenMsg, path='',
+		http_method='POST', name='refreshToken')
+	def refreshToken(self, request):
+		""" Get new access token, given refresh token in request.accessToken. Return status and new access token. """
+		status = AuthTokenMsg()  # return status
+		status.data = 'error'  # default to error
+
+		try:
+			payload = _ca_token_verifier.decode(request.accessToken)
+		except:
+			return status
+
+		if payload.get('typ') != 'refresh':
+			return status
 
-				profile_key = ndb.Key(Profile, user_id)
-				profile = profile_key.get()
-				if profile is not None:
-					status.data = profile.loggedIn and (profile.session_id == session_id)
+		# Session must still be current, i.e. user hasn't logged out, logged in again or changed password since
+		user_id = payload.get('userId')
+		session_id = payload.get('session_id')
+		auth = self._getAuth(user_id)
+		if auth is None or not auth.loggedIn or auth.session_id != session_id:
+			return status
 
+		status.data = 'success'
+		status.accessToken, status.refreshToken = self._genTokens(user_id, session_id)
 		return status
 
-	@endpoints.method(AccountAuthMsg, StringMsg, path='',
+	@endpoints.method(AccountAuthMsg, AuthTokenMsg, path='',
 		http_method='POST', name='createAccount')
 	def createAccount(self, request):
 		""" Create new custom account """
-		status = StringMsg()  # return status
+		status = AuthTokenMsg()  # return status
 		status.data = 'error'  # default to error
 
 		# Verify if user passed reCAPTCHA
@@ -335,49 +754,48 @@ class TennisApi(remote.Service):
 
 		user_id = 'ca_' + request.email
 
-		# Get profile from datastore -- if profile not found, then profile=None
-		profile_key = ndb.Key(Profile, user_id)
-		profile = profile_key.get()
-
-		# If profile exists, return status
-		if profile:
+		# If user exists, return status
+		if self._getAuth(user_id):
 			status.data = 'user_exists'
 			return status
 
 		# Salt and hash the password
-		salt = Crypto.Random.new().read(16)
-		passkey = KDF.PBKDF2(request.password, salt).encode('hex')
-
-		salt_passkey = salt.encode('hex') + '|' + passkey
+		salt_passkey = self._hashPassword(request.password)
 
 		# Generate new session ID
 		session_id = Crypto.Random.new().read(16).encode('hex')
 
-		# Create new profile for user
-		Profile(
-			key = profile_key,
+		# Create new profile, credentials and player card for user
+		profile = Profile(
+			id = user_id,
 			userId = user_id,
 			contactEmail = request.email,
-			salt_passkey = salt_passkey,
-			session_id = session_id,
-			loggedIn = True,
 			emailVerified = False,
 			notifications = [False, True]
-		).put()
+		)
+		auth = Auth(
+			id = user_id,
+			salt_passkey = salt_passkey,
+			session_id = session_id,
+			loggedIn = True
+		)
+		ndb.put_multi([profile, auth, self._playerCard(profile)])
+		self._uncacheCards([user_id])
 
-		# Generate user access token
-		token = self._genToken({'userId': user_id, 'session_id': session_id})
+		# Generate user access and refresh tokens
+		access_token, refresh_token = self._genTokens(user_id, session_id)
 
 		# If we get here, means we suceeded
 		status.data = 'success'
-		status.accessToken = token
+		status.accessToken = access_token
+		status.refreshToken = refresh_token
 		return status
 
-	@endpoints.method(AccountAuthMsg, StringMsg, path='',
+	@endpoints.method(AccountAuthMsg, AuthTokenMsg, path='',
 		http_method='POST', name='login')
 	def login(self, request):
 		""" Check username/password to login """
-		status = StringMsg()  # return status
+		status = AuthTokenMsg()  # return status
 		status.data = 'error'  # default to error
 
 		# Verify if user passed reCAPTCHA
@@ -395,36 +813,36 @@ class TennisApi(remote.Service):
 
 		user_id = 'ca_' + request.email
 
-		# Get profile from datastore -- if profile not found, then profile=None
-		profile_key = ndb.Key(Profile, user_id)
-		profile = profile_key.get()
+		# Get credentials from datastore -- if user not found, then auth=None
+		auth = self._getAuth(user_id)
 
-		# If profile does not exist, return False
-		if not profile:
+		# If user does not exist, return False
+		if not auth:
 			return status
 
-		# Parse salt and passkey from DB, compare it to provided version
-		db_salt, db_passkey = profile.salt_passkey.split('|')
-		passkey = KDF.PBKDF2(request.password, db_salt.decode('hex')).encode('hex')
-
+		# Hash provided password with salt from DB, compare it to DB version
 		# Passwords don't match, return False
-		if passkey != db_passkey:
+		if not self._verifyPassword(request.password, auth.salt_passkey):
 			return status
 
+		# Upgrade legacy or weaker hash, now that we know the password
+		if passwords.needsRehash(auth.salt_passkey):
+			auth.salt_passkey = self._hashPassword(request.password)
+
 		# Generate new session ID
-		session_id = Crypto.Random.new().read(16).encode('hex')
-		profile.session_id = session_id
+		session_id = self._newSession(auth)
 
 		# Update user's status to logged-in
-		profile.loggedIn = True
-		profile.put()
+		auth.loggedIn = True
+		auth.put()
 
-		# Generate user access token
-		token = self._genToken({'userId': user_id, 'session_id': session_id})
+		# Generate user access and refresh tokens
+		access_token, refresh_token = self._genTokens(user_id, session_id)
 
 		# If we get here, means we suceeded
 		status.data = 'success'
-		status.accessToken = token
+		status.accessToken = access_token
+		status.refreshToken = refresh_token
 		return status
 
 	@endpoints.method(AccessTokenMsg, BooleanMsg, path='',
@@ -436,12 +854,13 @@ class TennisApi(remote.Service):
 
 		user_id = self._getUserId(request.accessToken)
 
-		# Get Profile from NDB, update login status
-		profile_key = ndb.Key(Profile, user_id)
-		profile = profile_key.get()
-		profile.session_id = 'invalid'
-		profile.loggedIn = False
-		profile.put()
+		# Get Auth from NDB, update login status
+		# Access tokens of the session would otherwise stay valid until they expire
+		auth = self._getAuth(user_id)
+		self._revokeSession(auth.session_id)
+		auth.session_id = 'invalid'
+		auth.loggedIn = False
+		auth.put()
 
 		status.data = True
 		return status
@@ -453,39 +872,31 @@ class TennisApi(remote.Service):
 		status = StringMsg()
 		status.data = 'error'
 
-		# Get user profile
+		# Get user credentials
 		user_id = self._getUserId(request.accessToken)
-		profile_key = ndb.Key(Profile, user_id)
-		profile = profile_key.get()
+		auth = self._getAuth(user_id)
 
 		# Not sure how this would happen, but it would be an error
-		if not profile:
+		if not auth:
 			return status
 
 		# Check if provided old password matches user's current password
-		db_salt, db_passkey = profile.salt_passkey.split('|')
-		passkey = KDF.PBKDF2(request.oldPw, db_salt.decode('hex')).encode('hex')
-
 		# Passwords don't match, return
-		if passkey != db_passkey:
+		if not self._verifyPassword(request.oldPw, auth.salt_passkey):
 			status.data = 'old_pw_wrong'
 			return status
 
 		# If passwords match, salt & hash new password
-		new_salt = Crypto.Random.new().read(16)
-		new_passkey = KDF.PBKDF2(request.newPw, new_salt).encode('hex')
-		new_salt_passkey = new_salt.encode('hex') + '|' + new_passkey
-		profile.salt_passkey = new_salt_passkey
+		auth.salt_passkey = self._hashPassword(request.newPw)
 
-		# Also generate new session ID
-		session_id = Crypto.Random.new().read(16).encode('hex')
-		profile.session_id = session_id
+		# Also generate new session ID, logging out the old session
+		self._newSession(auth)
 
 		# Update DB
-		profile.put()
+		auth.put()
 
 		# Send user an email to notify password change
-		self._emailPwChange(profile)
+		self._emailPwChange(ndb.Key(Profile, user_id).get())
 
 		# Return success status
 		status.data = 'success'
@@ -542,35 +953,35 @@ class TennisApi(remote.Service):
 
 		# Validate and decode token
 		try:
-			payload = jwt.decode(request.accessToken, CA_SECRET, algorithm='HS256')
+			payload = _ca_token_verifier.decode(request.accessToken)
 		except:
 			status.data = 'invalid_token'
 			return status
 
-		# Get user profile
+		# Only password reset tokens, a leaked access or refresh token must not set a new password
+		if payload.get('typ') != 'reset':
+			status.data = 'invalid_token'
+			return status
+
+		# Get user credentials
 		user_id = payload['userId']
-		profile_key = ndb.Key(Profile, user_id)
-		profile = profile_key.get()
+		auth = self._getAuth(user_id)
 
 		# Not sure how this would happen, but it would be an error
-		if not profile:
+		if not auth:
 			return status
 
 		# Salt & hash new password
-		new_salt = Crypto.Random.new().read(16)
-		new_passkey = KDF.PBKDF2(request.data, new_salt).encode('hex')
-		new_salt_passkey = new_salt.encode('hex') + '|' + new_passkey
-		profile.salt_passkey = new_salt_passkey
+		auth.salt_passkey = self._hashPassword(request.data)
 
-		# Also generate new session ID
-		session_id = Crypto.Random.new().read(16).encode('hex')
-		profile.session_id = session_id
+		# Also generate new session ID, logging out the old session
+		self._newSession(auth)
 
 		# Update DB
-		profile.put()
+		auth.put()
 
 		# Send user an email to notify password change
-		self._emailPwChange(profile)
+		self._emailPwChange(ndb.Key(Profile, user_id).get())
 
 		# Return success status
 		status.data = 'success'
@@ -582,60 +993,127 @@ class TennisApi(remote.Service):
 	###################################################################
 
 	def _getFbUserId(self, token):
-		""" Given token, find FB user ID from FB, and return it """
-		url = 'https://graph.facebook.com/v%s/me?access_token=%s&fields=id' % (FB_API_VERSION, token)
+		""" Given token, find FB user ID (cached, or from FB), and return it """
+		token_hash = hashlib.sha256(token or '').hexdigest()
+		now = time.time()
+
+		# Check per instance cache, then memcache
+		with _fb_user_ids_lock:
+			cached = _fb_user_ids.pop(token_hash, None)
+		if cached is None:
+			cached = memcache.get(FB_USER_ID_KEY % token_hash)
+
+		if cached is not None and cached[1] > now:
+			self._cacheFbUserId(token_hash, cached)
+			return cached[0]
+
+		# Ask FB who the token belongs to, and until when it is valid
+		# https://developers.facebook.com/docs/facebook-login/access-tokens/debugging-and-error-handling
+		url = 'https://graph.facebook.com/v%s/debug_token?input_token=%s&access_token=%s' % (FB_API_VERSION, token, self._getFbAppToken())
 		try:
 			result = urlfetch.Fetch(url, method=1)
 		except:
 			raise endpoints.BadRequestException('urlfetch error: Get FB user ID')
-			return None
 
 		data = json.loads(result.content)
-		if 'error' in data:
+		if 'error' in data or not data['data'].get('is_valid') or data['data'].get('app_id') != FB_APP_ID:
 			raise endpoints.BadRequestException('FB OAuth token error')
-			return None
 
-		user_id = 'fb_' + data['id']
+		user_id = 'fb_' + data['data']['user_id']
+
+		# Don't cache past token expiry (expires_at of 0 means it never expires)
+		expires = now + FB_USER_ID_TTL
+		expires_at = data['data'].get('expires_at', 0)
+		if expires_at:
+			expires = min(expires, expires_at)
+
+		if expires > now:
+			cached = (user_id, expires)
+			self._cacheFbUserId(token_hash, cached)
+			memcache.set(FB_USER_ID_KEY % token_hash, cached, time=int(expires - now) or 1)
+
 		return user_id
 
+	def _cacheFbUserId(self, token_hash, cached):
+		""" Add (userId, expires) to per instance cache, evicting least recently used entries """
+		with _fb_user_ids_lock:
+			_fb_user_ids[token_hash] = cached
+			while len(_fb_user_ids) > FB_USER_ID_CACHE_SIZE:
+				_fb_user_ids.popitem(last=False)
+
 	def _postFbNotif(self, user_id, message, href):
 		"""
 		Post FB notification with message to user
 		"""
-		# Get profile of user_id
-		profile_key = ndb.Key(Profile, user_id)
-		profile = profile_key.get()
-
 		# Only post FB notif if FB user and user enabled FB notifs
-		if not (user_id[:3] == 'fb_' and profile.notifications[0]):
+		if user_id[:3] != 'fb_':
+			return False
+
+		card = self._getCards([user_id])[0]
+		if card is None or not card.notifications[0]:
 			return False
 
 		fb_user_id = user_id[3:]
 
-		# Get App Access Token, different than User Token
-		# https://developers.facebook.com/docs/facebook-login/access-tokens/#apptokens
-		url = 'https://graph.facebook.com/v%s/oauth/access_token?grant_type=client_credentials&client_id=%s&client_secret=%s' % (FB_API_VERSION, FB_APP_ID, FB_APP_SECRET)
-		try:
-			result = urlfetch.Fetch(url, method=1)
-		except:
-			raise endpoints.BadRequestException('urlfetch error: FB app access token')
-			return False
+		token = self._getFbAppToken()
+		data = self._postFbNotifWithToken(fb_user_id, message, href, token)
+
+		# Cached app token may have been invalidated (e.g. app secret reset), refresh it and retry once
+		if 'error' in data and data['error'].get('code') == 190:
+			token = self._getFbAppToken(refresh=True)
+			data = self._postFbNotifWithToken(fb_user_id, message, href, token)
 
-		token = json.loads(result.content)['access_token']
+		if 'error' in data:
+			raise endpoints.BadRequestException('FB notification error')
+
+		return True
 
+	def _postFbNotifWithToken(self, fb_user_id, message, href, token):
+		""" POST FB notification using given app access token. Return decoded JSON response. """
 		url = 'https://graph.facebook.com/v%s/%s/notifications?access_token=%s&template=%s&href=%s' % (FB_API_VERSION, fb_user_id, token, message, href)
 		try:
 			result = urlfetch.Fetch(url, method=2)
 		except:
 			raise endpoints.BadRequestException('urlfetch error: Unable to POST FB notification')
-			return False
+
+		return json.loads(result.content)
+
+	def _getFbAppToken(self, refresh=False):
+		"""
+		Get App Access Token, different than User Token
+		https://developers.facebook.com/docs/facebook-login/access-tokens/#apptokens
+		Cached per instance and in memcache, so a notification fan-out fetches it at most once.
+		Set refresh=True to skip the caches, e.g. after FB rejected the cached token.
+		"""
+		now = time.time()
+
+		if not refresh:
+			if _fb_app_token['token'] and _fb_app_token['expires'] > now:
+				return _fb_app_token['token']
+
+			cached = memcache.get(FB_APP_TOKEN_KEY)
+			if cached is not None:
+				_fb_app_token.update(cached)
+				return cached['token']
+
+		url = 'https://graph.facebook.com/v%s/oauth/access_token?grant_type=client_credentials&client_id=%s&client_secret=%s' % (FB_API_VERSION, FB_APP_ID, FB_APP_SECRET)
+		try:
+			result = urlfetch.Fetch(url, method=1)
+		except:
+			raise endpoints.BadRequestException('urlfetch error: FB app access token')
 
 		data = json.loads(result.content)
-		if 'error' in data:
-			raise endpoints.BadRequestException('FB notification error')
-			return False
+		if 'access_token' not in data:
+			raise endpoints.BadRequestException('FB app access token error')
 
-		return True
+		# App tokens normally don't expire, but honor expires_in if FB sends one
+		ttl = min(int(data.get('expires_in', FB_APP_TOKEN_TTL)), FB_APP_TOKEN_TTL)
+		cached = {'token': data['access_token'], 'expires': now + ttl}
+
+		_fb_app_token.update(cached)
+		memcache.set(FB_APP_TOKEN_KEY, cached, time=ttl)
+
+		return cached['token']
 
 
 	@endpoints.method(AccessTokenMsg, StringMsg, path='',
@@ -692,24 +1170,26 @@ class TennisApi(remote.Service):
 				return status
 
 			# If user previously logged-out, update login status in NDB
-			if not profile.loggedIn:
-				profile.loggedIn = True
-				profile.put()
+			auth = self._getAuth(user_id)
+			if not auth.loggedIn:
+				auth.loggedIn = True
+				auth.put()
 
 			status.data = 'existing_user'
 			return status
 
-		# Else, create new profile and return 'new_user'
+		# Else, create new profile, credentials and player card, and return 'new_user'
 		profile = Profile(
 			key = profile_key,
 			userId = user_id,
 			contactEmail = email,
 			firstName = first_name,
 			lastName = last_name,
-			loggedIn = True,
 			emailVerified = False,
 			notifications = [True, False]
-		).put()
+		)
+		ndb.put_multi([profile, Auth(id=user_id, loggedIn=True), self._playerCard(profile)])
+		self._uncacheCards([user_id])
 
 		status.data = 'new_user'
 		return status
@@ -720,14 +1200,11 @@ class TennisApi(remote.Service):
 	###################################################################
 
 	@ndb.transactional(xg=True)
-	def _updateProfile(self, request):
+	def _updateProfile(self, request, user_id):
 		"""Update user profile."""
 		status = StringMsg()
 		status.data = 'normal'
 
-		token = request.accessToken
-		user_id = self._getUserId(token)
-
 		# Make sure the incoming message is initialized, raise exception if not
 		request.check_initialized()
 
@@ -744,6 +1221,8 @@ class TennisApi(remote.Service):
 				continue  # userId is fixed
 			elif user_id[:3] == 'ca_' and field.name == 'contactEmail':
 				continue  # custom account users cannot change email address
+			elif field.name == 'loggedIn':
+				continue  # session state lives in Auth
 			elif field.name != 'accessToken':
 				setattr(profile, field.name, getattr(request, field.name))
 
@@ -751,12 +1230,14 @@ class TennisApi(remote.Service):
 		# then send email verification
 		if profile.pristine or email_change:
 			profile.pristine = False
-			self._emailVerif(profile)
+			self._writeOutbox([['_emailVerif', [profile.userId, profile.contactEmail, profile.firstName, profile.lastName]]])
 
 			status.data = 'email_verif'
 
-		# Save updated profile to datastore
-		profile.put()
+		# Save updated profile and player card to datastore
+		ndb.put_multi([profile, self._playerCard(profile)])
+		self._uncacheCards([user_id])
+		self._recordChange(['u:' + user_id])  # skill band may have changed, see getChanges
 
 		return status
 
@@ -777,19 +1258,70 @@ class TennisApi(remote.Service):
 		if not profile:
 			return ProfileMsg()
 
-		# Else, copy profile to ProfileForm, and return it
+		return self._profileMsg(profile, self._getAuth(user_id).loggedIn)
+
+	def _profileMsg(self, profile, logged_in):
+		""" Copy profile to ProfileMsg, with login status from Auth, and return it """
 		pf = ProfileMsg()
 		for field in pf.all_fields():
 			if hasattr(profile, field.name):
 				setattr(pf, field.name, getattr(profile, field.name))
+		pf.loggedIn = logged_in
 		pf.check_initialized()
 		return pf
 
+	def _playerCard(self, profile):
+		""" Return PlayerCard with the display and notification fields of profile. Caller must put() it, then _uncacheCards. """
+		return PlayerCard(
+			id = profile.userId,
+			firstName = profile.firstName,
+			lastName = profile.lastName,
+			gender = profile.gender,
+			ntrp = profile.ntrp,
+			contactEmail = profile.contactEmail,
+			emailVerified = profile.emailVerified,
+			notifications = profile.notifications
+		)
+
+	def _getCards(self, user_ids):
+		"""
+		Get PlayerCards of users, in the same order, None for unknown users
+		Read through memcache, misses are filled with one batched get.
+		Users from before PlayerCard existed (or before it had notification fields) get theirs created from their Profile.
+		"""
+		cached = memcache.get_multi(user_ids, key_prefix=PLAYER_CARD_KEY % '')
+		missing = [user_id for user_id in user_ids if user_id not in cached]
+
+		if missing:
+			cards = ndb.get_multi([ndb.Key(PlayerCard, user_id) for user_id in missing])
+
+			stale = [missing[i] for i, card in enumerate(cards) if card is None or not card.notifications]
+			if stale:
+				profiles = ndb.get_multi([ndb.Key(Profile, user_id) for user_id in stale])
+				new_cards = [self._playerCard(profile) for profile in profiles if profile is not None]
+				ndb.put_multi(new_cards)
+
+				new_cards = {card.key.id(): card for card in new_cards}
+				cards = [new_cards.get(user_id) if user_id in new_cards else card for user_id, card in zip(missing, cards)]
+
+			found = {user_id: card for user_id, card in zip(missing, cards) if card is not None}
+			memcache.add_multi(found, time=PLAYER_CARD_TTL, key_prefix=PLAYER_CARD_KEY % '')
+			cached.update(found)
+
+		return [cached.get(user_id) for user_id in user_ids]
+
+	def _uncacheCards(self, user_ids):
+		""" Invalidate cached PlayerCards of users, once the transaction (if any) commits """
+		keys = [PLAYER_CARD_KEY % user_id for user_id in user_ids]
+		ndb.get_context().call_on_commit(lambda: memcache.delete_multi(keys))
+
 	@endpoints.method(ProfileMsg, StringMsg,
 			path='', http_method='POST', name='updateProfile')
 	def updateProfile(self, request):
 		"""Update user profile."""
-		return self._updateProfile(request)  # transactional
+		# Resolve user before the transaction, it may need a FB round trip
+		user_id = self._getUserId(request.accessToken)
+		return self._updateProfile(request, user_id)  # transactional
 
 
 	###################################################################
@@ -797,16 +1329,13 @@ class TennisApi(remote.Service):
 	###################################################################
 
 	@ndb.transactional(xg=True)
-	def _createMatch(self, request):
-		"""Create new Match, update user Profile to add new Match to Profile.
-		Also notify all applicable users this new match is available to them.
-		Returns MatchMsg/request."""
+	def _createMatch(self, request, user_id):
+		"""Create new Match, with the user as its owner.
+		Also enqueue task to notify all applicable users this new match is available to them.
+		Returns BooleanMsg status."""
 		status = BooleanMsg()
 		status.data = False
 
-		token = request.accessToken
-		user_id = self._getUserId(token)
-
 		# If any field in request is None, then raise exception
 		if any([getattr(request, field.name) is None for field in request.all_fields()]):
 			raise endpoints.BadRequestException('All input fields required to create a match')
@@ -819,15 +1348,10 @@ class TennisApi(remote.Service):
 		profile_key = ndb.Key(Profile, user_id)
 		profile = profile_key.get()
 
-		# Normalize NTRP if needed
-		ntrp = profile.ntrp
-		if profile.gender == 'f':
-			ntrp = profile.ntrp - 0.5
-
 		# Add default values for those missing
 		data['players']   = [user_id]
 		data['confirmed'] = False
-		data['ntrp']      = ntrp
+		data['ntrp']      = profile.skill  # normalized NTRP
 
 		# Convert date/time from string to datetime object
 		dt_string = data['date'] + '|' + data['time']
@@ -837,63 +1361,133 @@ class TennisApi(remote.Service):
 		del data['time']
 
 		# Create new match based on data, and put in datastore
-		match_key = Match(**data).put().urlsafe()
+		match = Match(**data)
+		match_key = match.put().urlsafe()
+		self._recordChange(self._matchScopes(match), match_key)
+		open_matches.reindexOpenMatch(match)
 
-		# Update user profile, adding the new match to Profile.matches
-		profile.matches.append(match_key)
-		profile.put()
+		# Add user to the match as its owner
+		self._playerMatch(match, user_id, 'owner').put()
+		self._rememberMyMatch(user_id, match_key)
+
+		# Notify potential partners in the background, only if this transaction commits
+		self._queueNotifyAvailMatch(user_id, match_key, dt_string2)
 
 		status.data = True
-		return status, profile, match_key, dt_string2
+		return status
 
-	def _notifyAvailMatch(self, profile, match_key, dt_string):
-		""" Notify all potential partners of newly created match """
-		# FIXME: Put this functionality in a task queue
+	def _queueNotifyAvailMatch(self, user_id, match_key, dt_string, cursor=None, batch=0, fanout=None, notify=True):
+		"""
+		Enqueue task to notify one batch of potential partners of newly created match
+		The first batch is enqueued transactionally by _createMatch. Later batches are chained
+		by NotifyAvailMatchHandler, named by fan-out id and batch number so a retried task can't enqueue them twice.
+		With notify=False, the batch only gets AvailableMatch inbox entries, see _fanOutAvailMatch.
+		"""
+		if fanout is None:
+			fanout = os.urandom(4).encode('hex')  # a match reopened by a leaving player is fanned out again
+
+		params = {
+			'user_id':   user_id,
+			'match_key': match_key,
+			'dt_string': dt_string,
+			'cursor':    cursor.urlsafe() if cursor else '',
+			'batch':     batch,
+			'fanout':    fanout,
+			'notify':    '1' if notify else '',
+		}
 
-		# Get name and NTRP of currently player
-		player_name = profile.firstName + ' ' + profile.lastName
-		my_ntrp = profile.ntrp
-		if profile.gender == 'f':
-			my_ntrp -= 0.5
+		if batch == 0:
+			taskqueue.add(queue_name=NOTIFY_QUEUE, url='/tasks/notify_avail_match', params=params, transactional=True)
+			return
 
-		# Query the DB to find partners of similar skill
-		query = Profile.query(ndb.OR(Profile.ntrp == my_ntrp, Profile.ntrp == my_ntrp + 0.5, Profile.ntrp == my_ntrp - 0.5))
+		try:
+			taskqueue.add(queue_name=NOTIFY_QUEUE, url='/tasks/notify_avail_match', params=params,
+				name='avail-match-%s-%s-%d' % (match_key, fanout, batch))
+		except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+			pass  # already enqueued by an earlier attempt of this task
 
-		for partner in query:
-			# Current user does not get notified
-			if profile.userId == partner.userId:
-				continue
+	def _getPartnersPage(self, profile, players, cursor=None):
+		"""
+		Get one batch of potential partners of similar skill to profile, starting at query cursor
+		Players already in the match (including profile's own user) are left out of the batch.
+		This is the one eligibility rule for both notifications and inbox entries of a match.
+		Returns (partners, next_cursor, more)
+		"""
+		my_skill = profile.skill
+
+		# Query the DB to find partners of similar skill
+		query = Profile.query(Profile.skill >= my_skill - SKILL_TOLERANCE, Profile.skill <= my_skill + SKILL_TOLERANCE)
+		partners, next_cursor, more = query.fetch_page(NOTIFY_BATCH_SIZE, start_cursor=cursor)
+
+		partners = [partner for partner in partners if partner.userId not in players]
+		return partners, next_cursor, more
+
+	def _notifyAvailMatch(self, profile, match_key, dt_string, partners):
+		""" Notify given potential partners (one batch from _getPartnersPage) of newly created match """
+		# Get name of currently player
+		player_name = profile.firstName + ' ' + profile.lastName
+
+		match_url = '?match_type=avail&match_id=' + match_key
+		email_message = 'You have a new available match with %s %s.' % (player_name, dt_string)
+		email_message += '<br>To view the match, <a href="http://www.georgesungtennis.com/%s">click here</a>.' % match_url
+
+		# Try FB and email notifications
+		# The functions themselves will test if FB user and/or if they enabled the notification
+		# One failing partner should not fail (and retry) the whole batch
+		for partner in partners:
+			try:
+				self._postFbNotif(partner.userId, urlquote('New available match with ' + player_name + ' ' + dt_string), match_url)
+			except Exception:
+				logging.exception('Unable to notify %s of available match %s', partner.userId, match_key)
 
-			# Notify the potential partner
-			match_url = '?match_type=avail&match_id=' + match_key
-			email_message = 'You have a new available match with %s %s.' % (player_name, dt_string)
-			email_message += '<br>To view the match, <a href="http://www.georgesungtennis.com/%s">click here</a>.' % match_url
+		# Email the whole batch in as few SparkPost transmissions as possible
+		self._emailAvailMatch(partners, email_message, player_name)
 
-			# Try FB and email notifications
-			# The functions themselves will test if FB user and/or if they enabled the notification
-			self._postFbNotif(partner.userId, urlquote('New available match with ' + player_name + ' ' + dt_string), match_url)
-			self._emailAvailMatch(partner, email_message, player_name)
+	def _fanOutAvailMatch(self, match, partners):
+		""" Write an AvailableMatch inbox entry of match for each given partner (one batch from _getPartnersPage) """
+		match_key = match.key.urlsafe()
+		ndb.put_multi([
+			AvailableMatch(parent=ndb.Key(Profile, partner.userId), id=match_key, match=match.key, dateTime=match.dateTime)
+			for partner in partners
+		])
+
+	def _queueRetractAvailMatch(self, match_key):
+		""" Enqueue task to delete every inbox entry of a match that filled up or was cancelled, if this transaction commits """
+		taskqueue.add(queue_name=NOTIFY_QUEUE, url='/tasks/retract_avail_match', params={'match_key': match_key}, transactional=True)
 
 
 	@endpoints.method(MatchMsg, BooleanMsg, path='',
 		http_method='POST', name='createMatch')
 	def createMatch(self, request):
 		"""Create new Match"""
-		#return self._createMatch(request)
+		user_id = self._getUserId(request.accessToken)
+		return self._createMatch(request, user_id)  # transactional
 
-		status, profile, match_key, dt_string = self._createMatch(request)
-		self._notifyAvailMatch(profile, match_key, dt_string)
 
-		return status
+	def _playerMatch(self, match, user_id, role):
+		""" Return new PlayerMatch membership of user in match, role is owner/player. Caller must put() it. """
+		return PlayerMatch(parent=match.key, id=user_id, userId=user_id, dateTime=match.dateTime, role=role)
+
+	def _rememberMyMatch(self, user_id, match_key):
+		""" Remember match user just created or joined, once this transaction commits, see _myMatchesPageAsync """
+		def remember():
+			client = memcache.Client()
+			key = RECENT_MATCHES_KEY % user_id
+			for _ in range(10):
+				recent = client.gets(key)
+				if recent is None:
+					if memcache.add(key, [match_key], time=RECENT_MATCHES_TTL):
+						return
+				elif client.cas(key, recent + [match_key], time=RECENT_MATCHES_TTL):
+					return
 
+		ndb.get_context().call_on_commit(remember)
 
 	@ndb.transactional(xg=True)
-	def _joinMatch(self, request):
+	def _joinMatch(self, request, user_id, player_name):
 		"""Join an available Match, given Match's key.
+		Player's name is read by the caller from their PlayerCard, so no Profile is written (just the match, Outbox and MatchChange).
 		If there is mid-air collision, return false. If successful, return true."""
-		token = request.accessToken
-		user_id = self._getUserId(token)
-
 		# If any field in request is None, then raise exception
 		if request.data is None:
 			raise endpoints.BadRequestException('Need match ID from request.data')
@@ -903,13 +1497,7 @@ class TennisApi(remote.Service):
 		match = ndb.Key(urlsafe=match_key).get()
 
 		# Make sure match is not full. If full, return false.
-		match_full = False
-		if match.singles and len(match.players) >= 2:
-			match_full = True
-		elif not match.singles and len(match.players) >= 4:
-			match_full = True
-
-		if match_full:
+		if match.full:
 			status = BooleanMsg()
 			status.data = False
 			return status
@@ -920,28 +1508,35 @@ class TennisApi(remote.Service):
 		if match.singles or len(match.players) >= 4:
 			match.confirmed = True
 
+			# Match is on, schedule its reminder (only enqueued if this transaction commits)
+			self._queueReminder(match, match_key)
+
+		# Match is no longer available to anyone, take it out of partners' inboxes
+		if match.full and AVAILABLE_MATCHES_INBOX:
+			self._queueRetractAvailMatch(match_key)
+
 		# Update Match db
 		match.put()
+		self._recordChange(self._matchScopes(match), match_key)
+		open_matches.reindexOpenMatch(match)
 
-		# Add current match key to current user's matches list
-		profile_key = ndb.Key(Profile, user_id)
-		profile = profile_key.get()
-		profile.matches.append(match_key)
-		profile.put()
+		# Add current user to the match
+		self._playerMatch(match, user_id, 'player').put()
+		self._rememberMyMatch(user_id, match_key)
 
 		# Notify all other players that current user/player has joined the match
-		player_name = profile.firstName + ' ' + profile.lastName
-		for other_player in match.players:
-			if other_player == user_id:
-				continue
+		other_players = [player for player in match.players if player != user_id]
 
-			match_url = '?match_type=conf_pend&match_id=' + match_key
-			email_message = '%s has <b>joined</b> your match. To view your match, <a href="http://www.georgesungtennis.com/%s">click here</a>.' % (player_name, match_url)
+		match_url = '?match_type=conf_pend&match_id=' + match_key
+		email_message = '%s has <b>joined</b> your match. To view your match, <a href="http://www.georgesungtennis.com/%s">click here</a>.' % (player_name, match_url)
 
-			# Try FB and email notifications
-			# The functions themselves will test if FB user and/or if they enabled the notification
-			self._postFbNotif(other_player, urlquote(player_name + ' has joined your match'), match_url)
-			self._emailMatchUpdate(other_player, email_message, player_name, 'joined')
+		# Try FB and email notifications, once this transaction commits
+		# The functions themselves will test if FB user and/or if they enabled the notification
+		effects = []
+		for other_player in other_players:
+			effects.append(['_postFbNotif', [other_player, urlquote(player_name + ' has joined your match'), match_url]])
+		effects.append(['_emailMatchUpdate', [other_players, email_message, player_name, 'joined']])
+		self._writeOutbox(effects)
 
 		# Return true, for success
 		status = BooleanMsg()
@@ -953,19 +1548,22 @@ class TennisApi(remote.Service):
 		http_method='POST', name='joinMatch')
 	def joinMatch(self, request):
 		"""Join an available Match, given Match's key"""
-		return self._joinMatch(request)
+		user_id = self._getUserId(request.accessToken)
+
+		card = self._getCards([user_id])[0]
+		player_name = card.firstName + ' ' + card.lastName
+
+		return self._joinMatch(request, user_id, player_name)  # transactional
 
 
 	@ndb.transactional(xg=True)
-	def _cancelMatch(self, request):
+	def _cancelMatch(self, request, user_id, player_name):
 		"""Cancel an existing Match, given Match's key.
+		Player's name is read by the caller from their PlayerCard, so no Profile is written (just the match, Outbox and MatchChange).
 		If successful, return true."""
 		status = BooleanMsg()
 		status.data = False
 
-		token = request.accessToken
-		user_id = self._getUserId(token)
-
 		# If any field in request is None, then raise exception
 		if request.data is None:
 			raise endpoints.BadRequestException('Need match ID from request.data')
@@ -977,47 +1575,58 @@ class TennisApi(remote.Service):
 
 		# Determine if cancelling player is the owner of the match
 		owner_leaving = match.players[0] == user_id
+		was_full = match.full
 
 		# Update 'players' and 'confirmed' fields
 		match.players.remove(user_id)
 		match.confirmed = False
+		match.reminderId = None  # cancels any pending reminder, see _sendReminder
 
-		# Remove current match key from current user's matches list
-		profile = ndb.Key(Profile, user_id).get()
-		profile.matches.remove(match_key)
-		profile.put()
+		# Remove current user from the match
+		# If owner left, means the entire match is cancelled, so every other player is removed too
+		if owner_leaving:
+			removed_players = [user_id] + match.players
+		else:
+			removed_players = [user_id]
+		ndb.delete_multi([ndb.Key(PlayerMatch, player, parent=match.key) for player in removed_players])
 
 		# Notify all other players that current user/player has left the match
-		player_name = profile.firstName + ' ' + profile.lastName
 		match_url = '?match_type=conf_pend&match_id=' + match_key
 
-		for other_player in match.players:
-			# Try FB and email notifications
-			# The functions themselves will test if FB user and/or if they enabled the notification
-			if owner_leaving:
-				# FB
-				self._postFbNotif(other_player, urlquote(player_name + ' has cancelled your match'), '')
+		if owner_leaving:
+			fb_message = urlquote(player_name + ' has cancelled your match')
+			fb_href = ''
+			email_message = '%s has <b>cancelled</b> your match. <a href="http://www.georgesungtennis.com/">Click here</a> to visit the homepage.' % player_name
+			action = 'cancelled'
+		else:
+			fb_message = urlquote(player_name + ' has left your match')
+			fb_href = match_url
+			email_message = '%s has <b>left</b> your match. <a href="http://www.georgesungtennis.com/%s">Click here</a> to view your match.' % (player_name, match_url)
+			action = 'left'
 
-				# Email
-				email_message = '%s has <b>cancelled</b> your match. <a href="http://www.georgesungtennis.com/">Click here</a> to visit the homepage.' % player_name
-				self._emailMatchUpdate(other_player, email_message, player_name, 'cancelled')
-			else:
-				# FB
-				self._postFbNotif(other_player, urlquote(player_name + ' has left your match'), match_url)
+		# Try FB and email notifications, once this transaction commits
+		# The functions themselves will test if FB user and/or if they enabled the notification
+		effects = [['_emailMatchUpdate', [list(match.players), email_message, player_name, action]]]
 
-				# Email
-				email_message = '%s has <b>left</b> your match. <a href="http://www.georgesungtennis.com/%s">Click here</a> to view your match.' % (player_name, match_url)
-				self._emailMatchUpdate(other_player, email_message, player_name, 'left')
+		for other_player in match.players:
+			effects.append(['_postFbNotif', [other_player, fb_message, fb_href]])
 
-			# If owner left, means the entire match is cancelled. Remove this match from other_player's match list
+		self._writeOutbox(effects)
+		self._recordChange(self._matchScopes(match, [user_id]), match_key)
+		open_matches.reindexOpenMatch(match, deleted=owner_leaving)
+
+		# Keep partners' inboxes in step: a cancelled match is retracted, a full match that reopened is fanned out again
+		if AVAILABLE_MATCHES_INBOX:
 			if owner_leaving:
-				other_player_profile = ndb.Key(Profile, other_player).get()
-				other_player_profile.matches.remove(match_key)
-				other_player_profile.put()
+				self._queueRetractAvailMatch(match_key)
+			elif was_full:
+				self._queueNotifyAvailMatch(match.players[0], match_key, '', notify=False)
 
 		# Delete or update Match entity
+		# A cancelled match is deleted along with its descendants (MatchMessage chat), like the scrub job does
+		# Kindless ancestor query, so it includes the Match itself
 		if owner_leaving:
-			match.key.delete()
+			ndb.delete_multi(ndb.Query(ancestor=match.key).fetch(keys_only=True))
 		else:
 			match.put()
 
@@ -1029,7 +1638,12 @@ class TennisApi(remote.Service):
 		http_method='POST', name='cancelMatch')
 	def cancelMatch(self, request):
 		"""Cancel an existing Match, given Match's key"""
-		return self._cancelMatch(request)
+		user_id = self._getUserId(request.accessToken)
+
+		card = self._getCards([user_id])[0]
+		player_name = card.firstName + ' ' + card.lastName
+
+		return self._cancelMatch(request, user_id, player_name)  # transactional
 
 
 	@endpoints.method(StringArrayMsg, BooleanMsg, path='',
@@ -1049,31 +1663,30 @@ class TennisApi(remote.Service):
 		# Find user's name
 		token = request.accessToken
 		user_id = self._getUserId(token)
-		profile = ndb.Key(Profile, user_id).get()
-		player_name = profile.firstName + ' ' + profile.lastName
+		card = self._getCards([user_id])[0]
+		player_name = card.firstName + ' ' + card.lastName
 
 		# Get match key, then get the Match entity from db
 		match_key = request.data[0]
 		match = ndb.Key(urlsafe=match_key).get()
 
-		# Add the new message to match messages
+		# Add the new message to match messages, as its own entity so the Match isn't rewritten
 		msg = request.data[1]
-		match.msgs.append(player_name + '|' + msg)
-		match.put()
+		MatchMessage(parent=match.key, userId=user_id, name=player_name, text=msg).put()
+		self._recordChange(['u:' + player for player in match.players], match_key)
 
 		# Notify all other players that current user/player has posted a message
-		for other_player in match.players:
-			if other_player == user_id:
-				continue
+		other_players = [player for player in match.players if player != user_id]
 
-			match_url = '?match_type=conf_pend&match_id=' + match_key
-			email_message = '%s has posted a message in your match. To view your match, <a href="http://www.georgesungtennis.com/%s">click here</a>.' % (player_name, match_url)
-			email_message += '<br><br>Message:<br><i>%s</i>' % msg
+		match_url = '?match_type=conf_pend&match_id=' + match_key
+		email_message = '%s has posted a message in your match. To view your match, <a href="http://www.georgesungtennis.com/%s">click here</a>.' % (player_name, match_url)
+		email_message += '<br><br>Message:<br><i>%s</i>' % msg
 
-			# Try FB and email notifications
-			# The functions themselves will test if FB user and/or if they enabled the notification
+		# Try FB and email notifications
+		# The functions themselves will test if FB user and/or if they enabled the notification
+		for other_player in other_players:
 			self._postFbNotif(other_player, urlquote(player_name + ' has posted a message in your match'), match_url)
-			self._emailMatchUpdate(other_player, email_message, player_name, 'posted a message in')
+		self._emailMatchUpdate(other_players, email_message, player_name, 'posted a message in')
 
 		status.data = True
 		return status
@@ -1095,7 +1708,59 @@ class TennisApi(remote.Service):
 		# From match key, get Match entity, and get match messages
 		match_key = request.data
 		match = ndb.Key(urlsafe=match_key).get()
-		msgs.data = match.msgs
+		msgs.data = list(match.msgs)  # legacy messages, stored on the Match itself
+
+		query = MatchMessage.query(ancestor=match.key).order(MatchMessage.posted)
+		msgs.data += [match_msg.name + '|' + match_msg.text for match_msg in query]
+
+		return msgs
+
+	@endpoints.method(MatchMsgsPageMsg, MatchMsgsMsg, path='',
+		http_method='POST', name='getMatchMsgsSince')
+	def getMatchMsgsSince(self, request):
+		"""
+		Get match messages posted after the given cursor, given Match's key
+		Leave cursor empty to get messages from the start, then pass back the returned cursor to poll for new ones
+		"""
+		msgs = MatchMsgsMsg()
+		msgs.data = []
+
+		# Authenticate user
+		token = request.accessToken
+		user_id = self._getUserId(token)
+		if user_id is None:
+			return None
+
+		match_key = ndb.Key(urlsafe=request.matchKey)
+
+		if request.cursor == MATCH_MSGS_START_CURSOR:
+			start_cursor = None
+		elif request.cursor:
+			try:
+				start_cursor = Cursor(urlsafe=request.cursor)
+			except:
+				raise endpoints.BadRequestException('Invalid cursor')
+		else:
+			# First fetch, include legacy messages stored on the Match itself
+			start_cursor = None
+			match = match_key.get()
+			if match is None:
+				return msgs
+			msgs.data += match.msgs
+
+		# Ancestor query, so it is strongly consistent and sees messages posted just before
+		query = MatchMessage.query(ancestor=match_key).order(MatchMessage.posted)
+		page, next_cursor, more = query.fetch_page(MATCH_MSGS_PAGE_SIZE, start_cursor=start_cursor)
+
+		msgs.data += [match_msg.name + '|' + match_msg.text for match_msg in page]
+
+		# No new messages, client keeps polling from where it was
+		# Never hand back an empty cursor, or the client would get the legacy messages again
+		if next_cursor is not None:
+			msgs.cursor = next_cursor.urlsafe()
+		else:
+			msgs.cursor = request.cursor or MATCH_MSGS_START_CURSOR
+		msgs.more = more
 
 		return msgs
 
@@ -1104,13 +1769,31 @@ class TennisApi(remote.Service):
 	# Queries
 	###################################################################
 
-	def _appendMatchesMsg(self, match, t_delta, matches_msg):
-		# Ignore matches in the past, or matches that will occur in less than t_delta minutes
+	def _localNow(self):
+		""" Return current local time as naive datetime, comparable to Match.dateTime """
 		# Note we store matches in naive time, but datetime.now() returns UTC time,
 		# so we use tzinfo object to convert to local time
-		if match.dateTime - timedelta(minutes=t_delta) < datetime.now(Eastern_tzinfo()).replace(tzinfo=None):
-			return
+		return datetime.now(Eastern_tzinfo()).replace(tzinfo=None)
 
+	def _isUpcoming(self, match, t_delta):
+		""" Return True if match occurs more than t_delta minutes from now """
+		return match.dateTime - timedelta(minutes=t_delta) >= self._localNow()
+
+	def _getPlayerCards(self, matches):
+		"""
+		Get PlayerCards of every player in the given matches, in one batched cache/datastore read, see _getCards
+		Returns dict of userId -> PlayerCard
+		"""
+		player_ids = []
+		for match in matches:
+			for player_id in match.players:
+				if player_id not in player_ids:
+					player_ids.append(player_id)
+
+		return dict(zip(player_ids, self._getCards(player_ids)))
+
+	def _appendMatchesMsg(self, match, cards, matches_msg):
+		""" Append match to matches_msg, given dict of PlayerCards from _getPlayerCards """
 		# Convert datetime object into separate date and time strings
 		date, time = match.dateTime.strftime('%m/%d/%Y|%H:%M').split('|')
 
@@ -1118,12 +1801,12 @@ class TennisApi(remote.Service):
 		# e.g. ['Bob Smith|John Doe|Alice Wonderland|Foo Bar', 'Blah Blah|Hello World']
 		players = ''
 		for player_id in match.players:
-			player_profile = ndb.Key(Profile, player_id).get()
+			card = cards[player_id]
 
-			first_name  = player_profile.firstName
-			last_name   = player_profile.lastName
-			ntrp        = player_profile.ntrp
-			gender      = player_profile.gender.capitalize()
+			first_name  = card.firstName
+			last_name   = card.lastName
+			ntrp        = card.ntrp
+			gender      = card.gender.capitalize()
 
 			players += first_name + ' ' + last_name + ' (' + str(ntrp) + gender + '), '
 		players = players.rstrip(', ')
@@ -1139,23 +1822,65 @@ class TennisApi(remote.Service):
 
 		# No need to return anything, matches_msg is a reference, so you modified the original thing
 
+	def _buildMatchesMsg(self, matches, cards=None):
+		"""
+		Create MatchesMsg from list of Match entities, batch-loading all PlayerCards up front
+		Pass cards (from _getPlayerCards) if they have already been loaded
+		"""
+		matches_msg = MatchesMsg()
+		if cards is None:
+			cards = self._getPlayerCards(matches)
 
-	@endpoints.method(AccessTokenMsg, MatchesMsg,
-			path='', http_method='POST', name='getMyMatches')
-	def getMyMatches(self, request):
-		"""Get all confirmed or pending matches for current user."""
-		token = request.accessToken
-		user_id = self._getUserId(token)
+		for match in matches:
+			self._appendMatchesMsg(match, cards, matches_msg)
 
-		# Get user Profile based on userId (email)
-		profile = ndb.Key(Profile, user_id).get()
+		return matches_msg
 
-		# Create new MatchesMsg message
-		matches_msg = MatchesMsg()
 
-		# For each match is user's matches, add the info to match_msg
-		for match_key in profile.matches:
-			match = ndb.Key(urlsafe=match_key).get()
+	def _pageSize(self, request):
+		""" Return page size requested in MatchesPageMsg, clamped to a sane range """
+		if not request.pageSize:
+			return MATCHES_PAGE_SIZE
+		return max(1, min(request.pageSize, MAX_MATCHES_PAGE_SIZE))
+
+	def _pageCursor(self, earliest, next_cursor):
+		"""
+		Return page cursor string handed to clients: the query's dateTime cutoff and its datastore cursor
+		A datastore cursor is only valid for the exact query it came from, so later pages rebuild the query
+		from the carried cutoff instead of the current time, see _parsePageCursor
+		"""
+		return '%s|%s' % (earliest.strftime(PAGE_CURSOR_DT_FORMAT), next_cursor.urlsafe())
+
+	def _parsePageCursor(self, cursor, earliest):
+		"""
+		Return (dateTime cutoff, datastore Cursor) of a page cursor from _pageCursor
+		Cursors from before cutoffs were carried restart from the first page with cutoff 'earliest'
+		(the client drops matches it already has, see mergeMatches in dashboard.js)
+		"""
+		if '|' not in cursor:
+			return earliest, None
+
+		try:
+			dt_string, urlsafe = cursor.split('|', 1)
+			return datetime.strptime(dt_string, PAGE_CURSOR_DT_FORMAT), Cursor(urlsafe=urlsafe)
+		except:
+			raise endpoints.BadRequestException('Invalid cursor')
+
+	@ndb.tasklet
+	def _getMyMatchesAsync(self, user_id, match_keys):
+		"""
+		Fetch given Match keys of user in parallel, keeping their order
+		Returns future whose result is the list of matches still worth showing
+		"""
+		# Start every Match read at once, then wait on all of them together
+		matches = yield [match_key.get_async() for match_key in match_keys]
+
+		upcoming = []
+		for match in matches:
+			# Match may have been deleted, or user may have left it, since the membership query ran
+			# (query is eventually consistent)
+			if match is None or user_id not in match.players:
+				continue
 
 			# For confirmed matches, show it up to 1 hour after the match
 			# For pending matches, show it up to the exact time of the match
@@ -1164,49 +1889,680 @@ class TennisApi(remote.Service):
 			else:
 				t_delta = 0
 
-			self._appendMatchesMsg(match, t_delta, matches_msg)
+			if self._isUpcoming(match, t_delta):
+				upcoming.append(match)
+
+		raise ndb.Return(upcoming)
+
+	@ndb.tasklet
+	def _myMatchesPageAsync(self, user_id, page_size, cursor):
+		"""
+		Get one page of confirmed or pending matches for user
+		Returns future whose result is (matches, next cursor string, more)
+		"""
+		# Confirmed matches are shown up to 1 hour after the match, see _getMyMatchesAsync
+		# Later pages keep the first page's cutoff, so their query matches the cursor
+		earliest, start_cursor = self._localNow() - timedelta(minutes=60), None
+		if cursor:
+			earliest, start_cursor = self._parsePageCursor(cursor, earliest)
+
+		# Query user's memberships, earliest matches first, see index.yaml
+		query = PlayerMatch.query(PlayerMatch.userId == user_id, PlayerMatch.dateTime >= earliest)
+		query = query.order(PlayerMatch.dateTime)
+
+		keys, next_cursor, more = yield query.fetch_page_async(page_size, start_cursor=start_cursor, keys_only=True)
+		more = more and next_cursor is not None
+
+		# Each PlayerMatch is a child of its Match
+		match_keys = [key.parent() for key in keys]
+
+		# The query may not see memberships written moments ago yet, so merge in matches user just
+		# created or joined, on the first page only
+		recent = []
+		if not cursor:
+			recent = [ndb.Key(urlsafe=match_key) for match_key in memcache.get(RECENT_MATCHES_KEY % user_id) or []]
+			recent = [match_key for match_key in recent if match_key not in match_keys]
+
+		matches, recent_matches = yield (
+			self._getMyMatchesAsync(user_id, match_keys),
+			self._getMyMatchesAsync(user_id, recent),
+		)
+
+		if recent_matches:
+			# Ones after this page's last match belong to a later page, and the query will have caught up by then
+			if more and matches:
+				recent_matches = [match for match in recent_matches if match.dateTime <= matches[-1].dateTime]
+			matches = sorted(matches + recent_matches, key=lambda match: match.dateTime)
+
+		raise ndb.Return((matches, self._pageCursor(earliest, next_cursor) if more else None, more))
+
+	@ndb.tasklet
+	def _availableMatchesPageAsync(self, user_id, skill, page_size, cursor):
+		"""
+		Get one page of available matches for user, from partners of similar skill (user's normalized NTRP)
+		Served from user's inbox if AVAILABLE_MATCHES_INBOX, otherwise from the open match index
+		of user's skill band, unless that band has too many open matches
+		Returns future whose result is (matches, next cursor string, more)
+		"""
+		# Only show available matches that occur more than 1 hour from now
+		earliest = self._localNow() + timedelta(minutes=60)
+
+		if AVAILABLE_MATCHES_INBOX:
+			page = yield self._inboxMatchesPageAsync(user_id, earliest, page_size, cursor)
+			raise ndb.Return(page)
+
+		if cursor and cursor.startswith(OPEN_MATCHES_CURSOR):
+			after = self._parseOpenMatchesCursor(cursor)
+		else:
+			after = None
+		start_cursor = None
+
+		if not cursor or after is not None:
+			entry = open_matches.openMatches(skillBand(skill))
+			if entry['complete']:
+				raise ndb.Return(self._openMatchesPage(entry, user_id, earliest, page_size, after))
+
+		# Index is incomplete, query the DB instead
+		if after is not None:
+			# Carry on from where the index page left off, matches up to 'after' are skipped below
+			earliest = max(earliest, after[0])
+		elif cursor:
+			# Later pages keep the first page's cutoff, so their query matches the cursor
+			earliest, start_cursor = self._parsePageCursor(cursor, earliest)
+
+		# Query the DB to find open matches where partner is of similar skill
+		# Skill, past and full matches are all filtered by one index scan, see index.yaml
+		query = Match.query(Match.skillBands == skillBand(skill), Match.full == False, Match.dateTime >= earliest)
+		query = query.order(Match.dateTime)  # ascending datetime order (i.e. earliest matches first)
+
+		page, next_cursor, more = yield query.fetch_page_async(page_size, start_cursor=start_cursor)
+
+		matches = []
+		for match in page:
+			# Ignore matches current user is already participating in
+			if user_id in match.players:
+				continue
+
+			# Ignore matches the index page already returned, they share its last match's dateTime
+			if after is not None and open_matches.openMatchOrder(match) <= after:
+				continue
+
+			matches.append(match)
+
+		more = more and next_cursor is not None
+		raise ndb.Return((matches, self._pageCursor(earliest, next_cursor) if more else None, more))
+
+	@ndb.tasklet
+	def _inboxMatchesPageAsync(self, user_id, earliest, page_size, cursor):
+		"""
+		Get one page of available matches for user from their AvailableMatch inbox, see _availableMatchesPageAsync
+		'earliest' is the dateTime cutoff of the first page, later pages use the one in their cursor
+		Returns future whose result is (matches, next cursor string, more)
+		"""
+		start_cursor = None
+		if cursor:
+			earliest, start_cursor = self._parsePageCursor(cursor, earliest)
+
+		# Ancestor query, so entries written by _fanOutAvailMatch are seen right away, see index.yaml
+		query = AvailableMatch.query(AvailableMatch.dateTime >= earliest, ancestor=ndb.Key(Profile, user_id))
+		query = query.order(AvailableMatch.dateTime)
+
+		keys, next_cursor, more = yield query.fetch_page_async(page_size, start_cursor=start_cursor, keys_only=True)
+
+		# Key id of each entry is the urlsafe Match key
+		page = yield [ndb.Key(urlsafe=key.id()).get_async() for key in keys]
+
+		# Entries are retracted in the background, so skip matches that filled up or were cancelled meanwhile
+		matches = []
+		for match in page:
+			if match is None or match.full or user_id in match.players:
+				continue
+
+			matches.append(match)
+
+		more = more and next_cursor is not None
+		raise ndb.Return((matches, self._pageCursor(earliest, next_cursor) if more else None, more))
+
+	###################################################################
+	# Open Match Index
+	###################################################################
+
+	def _openMatchesPage(self, entry, user_id, earliest, page_size, after=None):
+		"""
+		Get one page of available matches for user from open match index entry, see _availableMatchesPageAsync
+		'after' is the open_matches.openMatchOrder of the last match of the previous page, if any
+		Returns (matches, next cursor string, more)
+		"""
+		matches = []
+		for match in entry['matches']:
+			if match.dateTime < earliest or match.full:
+				continue
+
+			# Ignore matches current user is already participating in
+			if user_id in match.players:
+				continue
+
+			if after is not None and open_matches.openMatchOrder(match) <= after:
+				continue
 
+			matches.append(match)
+			if len(matches) > page_size:
+				break
+
+		more = len(matches) > page_size
+		matches = matches[:page_size]
+
+		next_cursor = None
+		if more:
+			last = matches[-1]
+			next_cursor = '%s%s|%s' % (OPEN_MATCHES_CURSOR, last.dateTime.strftime('%Y%m%d%H%M%S'), last.key.urlsafe())
+
+		return matches, next_cursor, more
+
+	def _parseOpenMatchesCursor(self, cursor):
+		""" Return open_matches.openMatchOrder of the match an open match index cursor points after """
+		try:
+			dt_string, match_key = cursor[len(OPEN_MATCHES_CURSOR):].split('|')
+			return (datetime.strptime(dt_string, '%Y%m%d%H%M%S'), match_key)
+		except ValueError:
+			raise endpoints.BadRequestException('Invalid cursor')
+
+	def _pageMatchesMsg(self, page, cards=None):
+		""" Create MatchesMsg from (matches, next cursor, more) page, see _buildMatchesMsg """
+		matches, next_cursor, more = page
+
+		matches_msg = self._buildMatchesMsg(matches, cards)
+		matches_msg.nextCursor = next_cursor
+		matches_msg.more = more
 		return matches_msg
 
-	@endpoints.method(AccessTokenMsg, MatchesMsg,
+	@endpoints.method(MatchesPageMsg, MatchesMsg,
+			path='', http_method='POST', name='getMyMatches')
+	def getMyMatches(self, request):
+		"""Get one page of confirmed or pending matches for current user."""
+		token = request.accessToken
+		user_id = self._getUserId(token)
+
+		page = self._myMatchesPageAsync(user_id, self._pageSize(request), request.cursor).get_result()
+		return self._pageMatchesMsg(page)
+
+	@endpoints.method(MatchesPageMsg, MatchesMsg,
 			path='', http_method='POST', name='getAvailableMatches')
 	def getAvailableMatches(self, request):
 		"""
-		Get all available matches for current user.
+		Get one page of available matches for current user.
 		Search through DB to find partners of similar skill.
 		"""
 		token = request.accessToken
 		user_id = self._getUserId(token)
 
-		# Get user Profile based on userId
-		profile = ndb.Key(Profile, user_id).get()
+		page = self._availableMatchesPageAsync(user_id, self._cardSkill(user_id), self._pageSize(request), request.cursor).get_result()
+		return self._pageMatchesMsg(page)
 
-		# Create new MatchesMsg message
-		matches_msg = MatchesMsg()
+	def _cardSkill(self, user_id):
+		""" Return user's normalized NTRP from their cached PlayerCard, so match lists don't read the whole Profile """
+		card = self._getCards([user_id])[0]
+		if card is None:
+			raise endpoints.BadRequestException('No such user')
+		return normalizeSkill(card.ntrp, card.gender)
 
-		# Women's NTRP is equivalent to -0.5 men's NTRP, from empirical observation
-		my_ntrp = profile.ntrp
-		if profile.gender == 'f':
-			my_ntrp -= 0.5
+	def _recommendCandidates(self, skill, earliest):
+		"""
+		Return iterable of open matches that could be recommended to user, earliest first
+		The open match index of user's skill band if complete, otherwise a streamed datastore query
+		"""
+		band = skillBand(skill)
 
-		# Query the DB to find matches where partner is of similar skill
-		query = Match.query(ndb.OR(Match.ntrp == my_ntrp, Match.ntrp == my_ntrp + 0.5, Match.ntrp == my_ntrp - 0.5))
-		query = query.order(Match.dateTime)  # ascending datetime order (i.e. earliest matches first)
+		entry = open_matches.openMatches(band)
+		if entry['complete']:
+			return entry['matches']
+
+		query = Match.query(Match.skillBands == band, Match.full == False, Match.dateTime >= earliest)
+		query = query.order(Match.dateTime)
+		return query.iter(limit=RECOMMEND_MAX_CANDIDATES, batch_size=RECOMMEND_QUERY_BATCH)
+
+	def _scoreMatch(self, match, skill, now, singles=None):
+		""" Return how good a match is for user of normalized NTRP skill, higher is better, see RECOMMEND_* in settings.py """
+		# Skill: 1 for the same normalized NTRP, down to 0 at the edge of SKILL_TOLERANCE
+		skill_score = max(0.0, 1 - abs(match.ntrp - skill) / SKILL_TOLERANCE)
+
+		# Time: 1 right now, halving by RECOMMEND_TIME_SCALE hours out
+		hours = max(0.0, (match.dateTime - now).total_seconds() / 3600)
+		time_score = RECOMMEND_TIME_SCALE / (RECOMMEND_TIME_SCALE + hours)
+
+		# Type: 1 if singles/doubles as asked, 0 if not, in between if user has no preference
+		if singles is None:
+			type_score = 0.5
+		else:
+			type_score = 1.0 if match.singles == singles else 0.0
+
+		# Fullness: 1 if only one spot is left, so joining confirms the match
+		spots = 2 if match.singles else 4
+		fullness_score = float(len(match.players)) / (spots - 1)
+
+		return (RECOMMEND_SKILL_WEIGHT * skill_score +
+			RECOMMEND_TIME_WEIGHT * time_score +
+			RECOMMEND_TYPE_WEIGHT * type_score +
+			RECOMMEND_FULLNESS_WEIGHT * fullness_score)
+
+	def _recommendMatches(self, user_id, skill, count, singles=None):
+		"""
+		Return the top count available matches for user, best first
+		Candidates are streamed through a heap of the best count so far, so memory stays bounded by count
+		"""
+		# Same as available matches, only matches more than 1 hour from now
+		now = self._localNow()
+		earliest = now + timedelta(minutes=60)
+
+		best = []  # min-heap of (score, -order, match), worst recommendation at best[0]
+		for order, match in enumerate(self._recommendCandidates(skill, earliest)):
+			if match.dateTime < earliest or match.full:
+				continue
 
-		for match in query:
 			# Ignore matches current user is already participating in
-			if profile.userId in match.players:
+			if user_id in match.players:
 				continue
 
-			# Ignore matches that are full
-			if (match.singles and len(match.players) == 2) or (not match.singles and len(match.players) == 4):
+			# On equal scores, earlier candidates (earlier matches) win
+			item = (self._scoreMatch(match, skill, now, singles), -order, match)
+			if len(best) < count:
+				heapq.heappush(best, item)
+			elif item > best[0]:
+				heapq.heapreplace(best, item)
+
+		return [match for score, order, match in sorted(best, reverse=True)]
+
+	@endpoints.method(RecommendMatchesMsg, MatchesMsg,
+			path='', http_method='POST', name='getRecommendedMatches')
+	def getRecommendedMatches(self, request):
+		"""
+		Get the best available matches for current user, ranked by skill, time, match type and fullness.
+		Unlike getAvailableMatches, this is not paged, just the top request.count matches.
+		"""
+		token = request.accessToken
+		user_id = self._getUserId(token)
+
+		count = max(1, min(request.count or MATCHES_PAGE_SIZE, MAX_MATCHES_PAGE_SIZE))
+		matches = self._recommendMatches(user_id, self._cardSkill(user_id), count, request.singles)
+		return self._buildMatchesMsg(matches)
+
+
+	###################################################################
+	# Dashboard
+	###################################################################
+
+	def _authenticate(self, token):
+		"""
+		Resolve user from token and load their Profile, reading Profile only once
+		Custom account sessions are checked the same way as verifyToken, before Profile is read.
+		Returns (Profile, logged-in status), or (None, False) if token is invalid or session is logged-out.
+		"""
+		ca_payload = self._decodeToken(token)
+		if ca_payload is not None:
+			if not self._checkSession(ca_payload):
+				return None, False
+			user_id = ca_payload['userId']
+			logged_in = True
+		else:
+			# If above failed, try FB token
+			try:
+				user_id = self._getFbUserId(token)
+			except endpoints.BadRequestException:
+				return None, False
+			auth = self._getAuth(user_id)
+			logged_in = auth is not None and auth.loggedIn
+
+		profile = ndb.Key(Profile, user_id).get()
+		if profile is None:
+			return None, False
+		return profile, logged_in
+
+	@endpoints.method(MatchesPageMsg, DashboardMsg,
+			path='', http_method='POST', name='getDashboard')
+	def getDashboard(self, request):
+		"""
+		Get everything the dashboard shows on load, in one round trip:
+		profile, and the first page of both my matches and available matches.
+		"""
+		dashboard = DashboardMsg()
+		dashboard.authenticated = False
+
+		profile, logged_in = self._authenticate(request.accessToken)
+		if profile is None:
+			return dashboard
+
+		dashboard.authenticated = True
+		dashboard.profile = self._profileMsg(profile, logged_in)
+		dashboard.syncVersion = self._syncVersion(profile, self._syncNow())  # before querying, see getChanges
+
+		# Incomplete profile, front-end will send user to the profile page
+		if profile.firstName == '' or profile.gender == '':
+			return dashboard
+
+		# Run both match queries concurrently, then batch-get players of both at once
+		page_size = self._pageSize(request)
+		my_future = self._myMatchesPageAsync(profile.userId, page_size, None)
+		avail_future = self._availableMatchesPageAsync(profile.userId, profile.skill, page_size, None)
+		my_page = my_future.get_result()
+		avail_page = avail_future.get_result()
+
+		cards = self._getPlayerCards(my_page[0] + avail_page[0])
+		dashboard.myMatches = self._pageMatchesMsg(my_page, cards)
+		dashboard.availableMatches = self._pageMatchesMsg(avail_page, cards)
+
+		return dashboard
+
+
+	###################################################################
+	# Delta Sync
+	###################################################################
+
+	def _syncNow(self):
+		""" Return current change version, microseconds since epoch """
+		return int(time.time() * 1000000)
+
+	def _syncVersion(self, profile, version):
+		""" Return version token for client, given user's Profile """
+		return '%d:%d' % (skillBand(profile.skill), version)
+
+	def _matchScopes(self, match, extra_players=()):
+		""" Return change scopes of everyone who may see match: its players, and partners eligible by skill """
+		scopes = ['u:' + player for player in list(match.players) + list(extra_players)]
+		scopes += ['b:%d' % band for band in match.skillBands]
+		return scopes
+
+	def _recordChange(self, scopes, match_key=None):
+		"""
+		Record that a match changed (or a user's Profile, if no match_key), for getChanges
+		Can be called inside a transaction, the change is recorded atomically with it.
+		"""
+		MatchChange(scopes=scopes, matchKey=match_key, version=self._syncNow()).put()
+
+		# Invalidate cached latest versions once the change is committed
+		keys = [SYNC_VERSION_KEY % scope for scope in scopes]
+		ndb.get_context().call_on_commit(lambda: memcache.delete_multi(keys))
+
+	def _latestVersions(self, scopes):
+		""" Return latest change version of each scope, cached in memcache """
+		keys = [SYNC_VERSION_KEY % scope for scope in scopes]
+		cached = memcache.get_multi(keys)
+
+		versions = []
+		for scope, key in zip(scopes, keys):
+			if key not in cached:
+				change = MatchChange.query(MatchChange.scopes == scope).order(-MatchChange.version).get()
+				cached[key] = change.version if change else 0
+				memcache.add(key, cached[key], time=SYNC_VERSION_TTL)
+			versions.append(cached[key])
+		return versions
+
+	@endpoints.method(SyncVersionMsg, ChangesMsg,
+			path='', http_method='POST', name='getChanges')
+	def getChanges(self, request):
+		"""
+		Get changes to user's dashboard since version (from getDashboard, or an earlier getChanges).
+		Returns only matches added, updated or removed since then. If nothing changed,
+		only the cached latest versions are read. If reset is set, client should reload the dashboard.
+		"""
+		changes = ChangesMsg()
+		changes.changed = False
+		changes.reset = False
+
+		token = request.accessToken
+		user_id = self._getUserId(token)
+
+		now = self._syncNow()
+		try:
+			band, since = [int(x) for x in request.version.split(':')]
+		except:
+			changes.reset = True
+			return changes
+
+		# Changes this old may have been scrubbed already
+		if since < now - SYNC_RETENTION:
+			changes.reset = True
+			return changes
+
+		# Cheap "nothing changed" check, against user's own matches and the skill band they see
+		scopes = ['u:' + user_id, 'b:%d' % band]
+		latest = max(self._latestVersions(scopes))
+		if latest <= since:
+			changes.version = request.version
+			return changes
+
+		# If user's skill band changed, the available matches are a different set altogether
+		profile = ndb.Key(Profile, user_id).get()
+		if skillBand(profile.skill) != band:
+			changes.reset = True
+			return changes
+
+		query = MatchChange.query(ndb.OR(MatchChange.scopes == scopes[0], MatchChange.scopes == scopes[1]))
+		query = query.filter(MatchChange.version > since - SYNC_SKEW).order(MatchChange.version)
+		recent = query.fetch(SYNC_MAX_CHANGES + 1)
+		if len(recent) > SYNC_MAX_CHANGES:
+			changes.reset = True
+			return changes
+
+		# Re-read each changed match, and decide which list (if any) it now belongs in for this user
+		match_keys = []
+		version = since
+		for change in recent:
+			version = max(version, change.version)
+			if change.matchKey and change.matchKey not in match_keys:
+				match_keys.append(change.matchKey)
+		matches = ndb.get_multi([ndb.Key(urlsafe=match_key) for match_key in match_keys])
+
+		my_matches = []
+		available_matches = []
+		removed = []
+		for match_key, match in zip(match_keys, matches):
+			if match is not None and user_id in match.players:
+				# Same rules as getMyMatches
+				if self._isUpcoming(match, -60 if match.confirmed else 0):
+					my_matches.append(match)
+					continue
+			elif match is not None and not match.full and band in match.skillBands:
+				# Same rules as getAvailableMatches
+				if self._isUpcoming(match, 60):
+					available_matches.append(match)
+					continue
+			removed.append(match_key)
+
+		cards = self._getPlayerCards(my_matches + available_matches)
+		changes.changed = True
+		changes.version = self._syncVersion(profile, version)
+		changes.myMatches = self._buildMatchesMsg(my_matches, cards)
+		changes.availableMatches = self._buildMatchesMsg(available_matches, cards)
+		changes.removed = removed
+
+		return changes
+
+
+###################################################################
+# Task Queue Handlers
+###################################################################
+
+class NotifyAvailMatchHandler(webapp2.RequestHandler):
+	"""
+	Notify one batch of potential partners of a newly created match
+	Enqueues the next batch first, so the query cursor is checkpointed before any notification goes out
+	"""
+	def post(self):
+		user_id = self.request.get('user_id')
+		match_key = self.request.get('match_key')
+		dt_string = self.request.get('dt_string')
+		batch = int(self.request.get('batch'))
+		fanout = self.request.get('fanout')
+		notify = bool(self.request.get('notify', '1'))  # tasks enqueued before inboxes existed always notify
+
+		cursor = self.request.get('cursor')
+		cursor = Cursor(urlsafe=cursor) if cursor else None
+
+		# Match may have been cancelled before we got to it
+		match = ndb.Key(urlsafe=match_key).get()
+		if match is None:
+			return
+
+		api = TennisApi()
+		profile = ndb.Key(Profile, user_id).get()
+
+		# Query this batch, and chain the task for the batch after it
+		partners, next_cursor, more = api._getPartnersPage(profile, match.players, cursor)
+		if more:
+			api._queueNotifyAvailMatch(user_id, match_key, dt_string, next_cursor, batch + 1, fanout, notify)
+
+		# Inbox entries of a match that's already full would only be retracted again
+		if AVAILABLE_MATCHES_INBOX and not match.full:
+			api._fanOutAvailMatch(match, partners)
+
+		if notify:
+			api._notifyAvailMatch(profile, match_key, dt_string, partners)
+
+
+class RetractAvailMatchHandler(webapp2.RequestHandler):
+	"""
+	Delete AvailableMatch inbox entries of a match that filled up or was cancelled, one batch per task
+	Chains itself until none are left. Re-running the query makes a retried task harmless.
+	Does nothing once the match is open again, so a late retract can't undo the fan-out of a reopened match.
+	"""
+	def post(self):
+		match_key = self.request.get('match_key')
+
+		if not self.retractable(match_key):
+			return
+
+		query = AvailableMatch.query(AvailableMatch.match == ndb.Key(urlsafe=match_key))
+		keys = query.fetch(RETRACT_BATCH_SIZE, keys_only=True)
+
+		# Match may have reopened while the query ran
+		if not self.retractable(match_key):
+			return
+
+		ndb.delete_multi(keys)
+
+		if len(keys) == RETRACT_BATCH_SIZE:
+			taskqueue.add(queue_name=NOTIFY_QUEUE, url='/tasks/retract_avail_match', params={'match_key': match_key})
+
+	def retractable(self, match_key):
+		""" Return True if match is gone or still full, so its inbox entries should go """
+		match = ndb.Key(urlsafe=match_key).get()
+		return match is None or match.full
+
+
+class DispatchOutboxHandler(webapp2.RequestHandler):
+	""" Run the side effects written to an Outbox by a committed transaction """
+	def post(self):
+		TennisApi()._dispatchOutbox(ndb.Key(urlsafe=self.request.get('key')))
+
+
+class MatchReminderHandler(webapp2.RequestHandler):
+	""" Send the reminder of a confirmed match, enqueued by TennisApi._queueReminder """
+	def post(self):
+		TennisApi()._sendReminder(self.request.get('match_key'), self.request.get('reminder_id'))
+
+
+class MigratePlayerMatchesHandler(webapp2.RequestHandler):
+	"""
+	One-time migration of Profile.matches lists to PlayerMatch entities, one batch of profiles per task
+	Run once after deploying, by an admin visiting the URL (GET). Safe to re-run, PlayerMatch keys are deterministic.
+	"""
+	def get(self):
+		self.migrate(None)
+
+	def post(self):
+		cursor = self.request.get('cursor')
+		self.migrate(Cursor(urlsafe=cursor) if cursor else None)
+
+	def migrate(self, cursor):
+		profiles, next_cursor, more = Profile.query().fetch_page(MIGRATE_BATCH_SIZE, start_cursor=cursor)
+		profiles = [profile for profile in profiles if profile.matches]
+
+		for profile in profiles:
+			self.migrateProfile(profile)
+
+		logging.info('Migrated matches of %d profiles', len(profiles))
+
+		if more and next_cursor is not None:
+			taskqueue.add(url=MIGRATE_PLAYER_MATCHES_URL, params={'cursor': next_cursor.urlsafe()})
+
+	def migrateProfile(self, profile):
+		"""
+		Create PlayerMatch for each of the profile's legacy matches that still exists, then empty the list
+		Memberships aren't written transactionally (a long list spans too many entity groups), but
+		nothing appends to Profile.matches anymore, and PlayerMatch keys are deterministic
+		"""
+		api = TennisApi()
+		matches = ndb.get_multi([ndb.Key(urlsafe=match_key) for match_key in profile.matches])
+		player_matches = []
+		for match in matches:
+			if match is None or profile.userId not in match.players:
 				continue
 
-			# Only show available matches that occur in less than 1 hour from now
-			self._appendMatchesMsg(match, 60, matches_msg)
+			role = 'owner' if match.players[0] == profile.userId else 'player'
+			player_matches.append(api._playerMatch(match, profile.userId, role))
 
-		return matches_msg
+		ndb.put_multi(player_matches)
+
+		self.clearMatches(profile.key, profile.matches)
+
+	@ndb.transactional
+	def clearMatches(self, profile_key, match_keys):
+		""" Remove migrated match keys from Profile.matches, re-reading the Profile so a concurrent update isn't lost """
+		profile = profile_key.get()
+		if profile is None:
+			return
+
+		profile.matches = [match_key for match_key in profile.matches if match_key not in match_keys]
+		profile.put()
+
+
+class ReputHandler(webapp2.RequestHandler):
+	"""
+	One-time re-put of every entity of a kind, one batch per task, so computed properties get indexed
+	Match.full, Match.skillBands and Profile.skill only reach the index when their entity is put,
+	and queries on them skip older rows. Run once per kind before deploying queries on them,
+	by an admin visiting the URL (GET) with ?kind=Match, then ?kind=Profile.
+	Safe to re-run.
+	"""
+	def get(self):
+		self.reput(self.request.get('kind'), None)
+
+	def post(self):
+		cursor = self.request.get('cursor')
+		self.reput(self.request.get('kind'), Cursor(urlsafe=cursor) if cursor else None)
+
+	def reput(self, kind, cursor):
+		if kind not in REPUT_KINDS:
+			self.abort(400, 'Unknown kind %s' % kind)
+
+		query = REPUT_KINDS[kind].query()
+		keys, next_cursor, more = query.fetch_page(REPUT_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+
+		for key in keys:
+			self.reputEntity(key)
+
+		logging.info('Re-put %d %s entities', len(keys), kind)
+
+		if more and next_cursor is not None:
+			taskqueue.add(url=REPUT_URL, params={'kind': kind, 'cursor': next_cursor.urlsafe()})
+
+	@ndb.transactional
+	def reputEntity(self, key):
+		""" Read and put entity in one transaction, so a concurrent update isn't overwritten """
+		entity = key.get()
+		if entity is not None:
+			entity.put()
 
 
 # registers API
 api = endpoints.api_server([TennisApi])
+
+# Task queue handlers, see app.yaml and queue.yaml
+tasks = webapp2.WSGIApplication([
+	('/tasks/notify_avail_match', NotifyAvailMatchHandler),
+	('/tasks/retract_avail_match', RetractAvailMatchHandler),
+	('/tasks/dispatch_outbox', DispatchOutboxHandler),
+	('/tasks/match_reminder', MatchReminderHandler),
+	(MIGRATE_PLAYER_MATCHES_URL, MigratePlayerMatchesHandler),
+	(REPUT_URL, ReputHandler),
+])
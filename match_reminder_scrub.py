@@ -1,30 +1,188 @@
 '''
-Cron job to send match reminders and delete old matches
+Cron job to delete old matches
+Reminders aren't sent from here, each confirmed match schedules its own, see TennisApi._queueReminder
+
+Expired matches are streamed in cursor-driven batches. Each batch is archived into
+the players' MatchHistory, then deleted along with its PlayerMatch memberships and chat.
+When the request nears its deadline, the job re-enqueues itself from its last
+checkpoint cursor, so it always finishes no matter how many matches piled up.
+Cutoffs are fixed when the job starts and carried along with the cursor, since a
+cursor is only valid for the exact query it came from.
 '''
 
 from datetime import datetime
 from datetime import timedelta
 from eastern_tzinfo import Eastern_tzinfo
-import json
-import os
-from django.utils.http import urlquote
+import logging
+import open_matches
+import time
+import webapp2
 
-from google.appengine.api import urlfetch
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
+from google.appengine.runtime import DeadlineExceededError
 
-from models import Profile
 from models import Match
+from models import AvailableMatch
+from models import MatchChange
+from models import MatchHistory
+from models import RevokedSession
+
+# Dashboard delta sync
+from settings import SYNC_RETENTION
+
+SCRUB_URL = '/cron/match_reminder_scrub'
+SCRUB_AFTER = timedelta(days=1)  # matches are scrubbed this long after they were played
+SCRUB_BATCH_SIZE = 100
+SCRUB_TIME_BUDGET = 8 * 60  # seconds, cron and task requests have 10 minutes
+
+# Phases of the job, run in order
+PHASE_MATCHES = 'matches'  # archive and delete expired matches
+PHASE_CHANGES = 'changes'  # delete dashboard changes older than any client can ask for, see main.getChanges
+PHASE_REVOKED = 'revoked'  # delete revoked sessions whose access tokens have all expired, see main._revokeSession
+PHASE_INBOX = 'inbox'  # delete available match inbox entries of expired matches, see main._fanOutAvailMatch
+
+
+def archiveMatches(matches):
+	"""
+	Append matches to each of their players' MatchHistory
+	Entries already archived (e.g. by an earlier attempt of the same batch) are skipped
+	"""
+	# Compact entry per match: [urlsafe key, 'mm/dd/yyyy HH:MM', location, singles, confirmed, [userIds]]
+	entries = {}
+	for match in matches:
+		entry = [
+			match.key.urlsafe(),
+			match.dateTime.strftime('%m/%d/%Y %H:%M'),
+			match.location,
+			match.singles,
+			match.confirmed,
+			list(match.players),
+		]
+		for player_id in match.players:
+			entries.setdefault(player_id, []).append(entry)
+
+	user_ids = list(entries.keys())
+	histories = ndb.get_multi([ndb.Key(MatchHistory, user_id) for user_id in user_ids])
+
+	for i, user_id in enumerate(user_ids):
+		history = histories[i] or MatchHistory(id=user_id, matches=[])
+		archived = set(entry[0] for entry in history.matches)
+		history.matches += [entry for entry in entries[user_id] if entry[0] not in archived]
+		histories[i] = history
+
+	ndb.put_multi(histories)
+
+
+def scrubMatches(matches):
+	""" Archive and delete one batch of expired matches """
+	archiveMatches(matches)
+
+	# Readers skip past matches anyway, this just keeps the open match index small
+	open_matches.updateOpenMatches(matches, deleted=True)
+
+	# Delete matches along with their descendants (PlayerMatch memberships, MatchMessage chat)
+	# Kindless ancestor query, so it includes the Match itself
+	keys = []
+	for match in matches:
+		keys += ndb.Query(ancestor=match.key).fetch(keys_only=True)
+	ndb.delete_multi(keys)
+
+
+class MatchReminderScrubHandler(webapp2.RequestHandler):
+	"""
+	Run the scrub job from the checkpoint in the request (if any) until done or out of time
+	GET is the daily cron entry, POST is a continuation task enqueued by the job itself
+	"""
+	def get(self):
+		self.scrub(PHASE_MATCHES, None, time.time())
+
+	def post(self):
+		cursor = self.request.get('cursor')
+		started = self.request.get('started')
+
+		# Continuations enqueued before cutoffs were carried along restart their phase, their cursor doesn't fit
+		if not started:
+			self.scrub(self.request.get('phase'), None, time.time())
+			return
+
+		self.scrub(self.request.get('phase'), Cursor(urlsafe=cursor) if cursor else None, float(started))
+
+	def scrub(self, phase, cursor, started):
+		""" 'started' is when the job started, in seconds since epoch, every cutoff is relative to it """
+		start = time.time()
+
+		try:
+			while phase is not None:
+				if time.time() - start > SCRUB_TIME_BUDGET:
+					self.resume(phase, cursor, started)
+					return
+
+				phase, cursor = self.scrubBatch(phase, cursor, started)
+		except DeadlineExceededError:
+			# Batch in flight is idempotent, so just redo it from the last checkpoint
+			self.resume(phase, cursor, started)
+
+	def scrubBatch(self, phase, cursor, started):
+		""" Process one batch of phase, starting at cursor. Returns (phase, cursor) of the next batch. """
+		# Note we store matches in naive local time, see TennisApi._localNow
+		match_cutoff = datetime.fromtimestamp(started, Eastern_tzinfo()).replace(tzinfo=None) - SCRUB_AFTER
+
+		if phase == PHASE_MATCHES:
+			query = Match.query(Match.dateTime < match_cutoff)
+			matches, next_cursor, more = query.fetch_page(SCRUB_BATCH_SIZE, start_cursor=cursor)
+
+			if matches:
+				scrubMatches(matches)
+				logging.info('Scrubbed %d expired matches', len(matches))
+
+			if more:
+				return PHASE_MATCHES, next_cursor
+			return PHASE_CHANGES, None
+
+		if phase == PHASE_CHANGES:
+			cutoff = int(started * 1000000) - SYNC_RETENTION
+			query = MatchChange.query(MatchChange.version < cutoff)
+			keys, next_cursor, more = query.fetch_page(SCRUB_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+
+			ndb.delete_multi(keys)
+
+			if more:
+				return PHASE_CHANGES, next_cursor
+			return PHASE_REVOKED, None
+
+		if phase == PHASE_REVOKED:
+			query = RevokedSession.query(RevokedSession.expires < int(started))
+			keys, next_cursor, more = query.fetch_page(SCRUB_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+
+			ndb.delete_multi(keys)
+
+			if more:
+				return PHASE_REVOKED, next_cursor
+			return PHASE_INBOX, None
+
+		if phase == PHASE_INBOX:
+			query = AvailableMatch.query(AvailableMatch.dateTime < match_cutoff)
+			keys, next_cursor, more = query.fetch_page(SCRUB_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+
+			ndb.delete_multi(keys)
+
+			if more:
+				return PHASE_INBOX, next_cursor
+			return None, None
+
+		raise ValueError('Unknown scrub phase %s' % phase)
+
+	def resume(self, phase, cursor, started):
+		""" Continue the job in a new request, from checkpoint phase and cursor """
+		taskqueue.add(url=SCRUB_URL, params={
+			'phase':   phase,
+			'cursor':  cursor.urlsafe() if cursor else '',
+			'started': repr(started),
+		})
 
 
-# Custom accounts
-from settings import CA_SECRET
-from settings import EMAIL_VERIF_SECRET
-# Facebook
-from settings import FB_APP_ID
-from settings import FB_APP_SECRET
-from settings import FB_API_VERSION
-# Google
-from settings import GRECAPTCHA_SECRET
-#from settings import WEB_CLIENT_ID
-# SparkPost
-from settings import SPARKPOST_SECRET
\ No newline at end of file
+app = webapp2.WSGIApplication([
+	(SCRUB_URL, MatchReminderScrubHandler),
+])
@@ -10,6 +10,36 @@ from protorpc import messages
 from google.appengine.ext import ndb
 
 import datetime
+import math
+
+from settings import SKILL_TOLERANCE
+from settings import SKILL_BAND_WIDTH
+
+
+##############################################
+# Skill normalization
+##############################################
+def normalizeSkill(ntrp, gender):
+	""" Return NTRP standardized to male rating """
+	# Women's NTRP is equivalent to -0.5 men's NTRP, from empirical observation
+	if gender == 'f':
+		return ntrp - 0.5
+	return ntrp
+
+def skillBand(skill):
+	""" Return index of the skill band that normalized skill falls in """
+	return int(round(skill / SKILL_BAND_WIDTH))
+
+def skillBands(skill):
+	"""
+	Return indices of every skill band within SKILL_TOLERANCE of normalized skill
+	Stored on Match, so finding matches for a player is one equality filter on skillBand(player skill),
+	leaving the single allowed inequality filter free for Match.dateTime
+	"""
+	eps = 1e-9  # guard against float rounding at the band edges
+	low = int(math.ceil((skill - SKILL_TOLERANCE) / SKILL_BAND_WIDTH - eps))
+	high = int(math.floor((skill + SKILL_TOLERANCE) / SKILL_BAND_WIDTH + eps))
+	return range(low, high + 1)
 
 ##############################################
 # User profile, and its messages
@@ -21,13 +51,38 @@ class Profile(ndb.Model):
 	lastName      = ndb.StringProperty(default='')
 	gender        = ndb.StringProperty(default='')  # m/f
 	ntrp          = ndb.FloatProperty(default=0.0)
-	matches       = ndb.StringProperty(repeated=True)  # match keys (store urlsafe version), dynamically changing
-	loggedIn      = ndb.BooleanProperty(default=False)
-	salt_passkey  = ndb.StringProperty(default='')
-	session_id    = ndb.StringProperty(default='')
+	matches       = ndb.StringProperty(repeated=True)  # legacy urlsafe match keys, memberships are now PlayerMatch entities
+	loggedIn      = ndb.BooleanProperty(default=False)  # legacy, moved to Auth
+	salt_passkey  = ndb.StringProperty(default='')  # legacy, moved to Auth
+	session_id    = ndb.StringProperty(default='')  # legacy, moved to Auth
 	emailVerified = ndb.BooleanProperty(default=False)
 	notifications = ndb.BooleanProperty(repeated=True)  # [fb_notif_en, email_notif_en]
 	pristine      = ndb.BooleanProperty(default=True)  # once user first updates Profile, it's not pristine anymore
+	skill         = ndb.ComputedProperty(lambda self: normalizeSkill(self.ntrp, self.gender))  # indexed, for partner range queries
+
+# Credentials and session of a user, so token checks, login and logout only touch this small entity
+class Auth(ndb.Model):
+	# Key id is userId
+	salt_passkey = ndb.StringProperty(default='', indexed=False)  # custom accounts only, hash format in passwords.py
+	session_id   = ndb.StringProperty(default='', indexed=False)
+	loggedIn     = ndb.BooleanProperty(default=False, indexed=False)
+
+# Custom account session logged-out (or replaced) while its access tokens may still be unexpired
+class RevokedSession(ndb.Model):
+	# Key id is session_id
+	expires = ndb.IntegerProperty(required=True)  # seconds since epoch, after which no access token of it is valid
+
+# Display and notification subset of a user's Profile, all that match lists and notifications need
+# Cached in memcache, see TennisApi._getCards
+class PlayerCard(ndb.Model):
+	# Key id is userId
+	firstName     = ndb.StringProperty(default='', indexed=False)
+	lastName      = ndb.StringProperty(default='', indexed=False)
+	gender        = ndb.StringProperty(default='', indexed=False)  # m/f
+	ntrp          = ndb.FloatProperty(default=0.0, indexed=False)
+	contactEmail  = ndb.StringProperty(default='', indexed=False)
+	emailVerified = ndb.BooleanProperty(default=False, indexed=False)
+	notifications = ndb.BooleanProperty(repeated=True, indexed=False)  # [fb_notif_en, email_notif_en]
 
 class ProfileMsg(messages.Message):
 	userId        = messages.StringField(1)
@@ -46,6 +101,13 @@ class AccountAuthMsg(messages.Message):
 	password  = messages.StringField(2)
 	recaptcha = messages.StringField(3)
 
+# Custom account login result, with both tokens
+# 'accessToken' is short-lived, get a new one by passing 'refreshToken' to refreshToken
+class AuthTokenMsg(messages.Message):
+	data         = messages.StringField(1)
+	accessToken  = messages.StringField(2)
+	refreshToken = messages.StringField(3)
+
 class ChangePasswordMsg(messages.Message):
 	oldPw       = messages.StringField(1)
 	newPw       = messages.StringField(2)
@@ -62,7 +124,25 @@ class Match(ndb.Model):
 	players   = ndb.StringProperty(repeated=True)  # userIds
 	confirmed = ndb.BooleanProperty(required=True)
 	ntrp      = ndb.FloatProperty(required=True)  # NTRP rating of owner of match, standardized to male rating
-	msgs      = ndb.StringProperty(repeated=True)  # messages posted by players in a match
+	msgs      = ndb.StringProperty(repeated=True)  # legacy 'name|msg' strings, new messages are MatchMessage entities
+	# Indexed so available match queries can skip full matches, recomputed on every put()
+	full      = ndb.ComputedProperty(lambda self: len(self.players) >= (2 if self.singles else 4))
+	skillBands = ndb.ComputedProperty(lambda self: skillBands(self.ntrp), repeated=True)  # see skillBands()
+	reminderId = ndb.StringProperty(indexed=False)  # id of pending reminder task, None if none, see TennisApi._queueReminder
+
+# Membership of a player in a match, so a player's matches are one ordered query
+# Parent is the Match key and key id is userId, so joining/leaving writes no Profile
+class PlayerMatch(ndb.Model):
+	userId   = ndb.StringProperty(required=True)
+	dateTime = ndb.DateTimeProperty(required=True)  # copy of Match.dateTime, never changes
+	role     = ndb.StringProperty(required=True, indexed=False)  # owner/player
+
+# Entry in a player's inbox of available matches, written when a match is fanned out to partners
+# Only used if settings.AVAILABLE_MATCHES_INBOX, see TennisApi._inboxMatchesPageAsync
+class AvailableMatch(ndb.Model):
+	# Parent is the player's Profile key and key id is the urlsafe Match key, so a player's inbox is one ancestor query
+	match    = ndb.KeyProperty(kind='Match', required=True)  # indexed, to retract entries once the match fills or is cancelled
+	dateTime = ndb.DateTimeProperty(required=True)  # copy of Match.dateTime, never changes
 
 class MatchMsg(messages.Message):
 	singles   = messages.BooleanField(1)
@@ -86,6 +166,98 @@ class MatchesMsg(messages.Message):
 	confirmed  = messages.BooleanField(6, repeated=True)
 	key        = messages.StringField(7, repeated=True)  # ndb key for each Match entity
 	accessToken = messages.StringField(8)
+	nextCursor = messages.StringField(9)  # opaque cursor to request the next page
+	more       = messages.BooleanField(10)  # True if there may be more pages after this one
+
+# Request for one page of matches
+# Leave 'cursor' empty for the first page, then pass back MatchesMsg.nextCursor
+class MatchesPageMsg(messages.Message):
+	accessToken = messages.StringField(1)
+	pageSize    = messages.IntegerField(2)
+	cursor      = messages.StringField(3)
+
+# Request for the top 'count' available matches for user, best first
+# Leave 'singles' empty for no singles/doubles preference
+class RecommendMatchesMsg(messages.Message):
+	accessToken = messages.StringField(1)
+	count       = messages.IntegerField(2)
+	singles     = messages.BooleanField(3)
+
+
+##############################################
+# Dashboard, everything shown on load in one message
+##############################################
+class DashboardMsg(messages.Message):
+	authenticated    = messages.BooleanField(1)  # False if token is invalid or session logged-out
+	profile          = messages.MessageField(ProfileMsg, 2)
+	myMatches        = messages.MessageField(MatchesMsg, 3)  # first page
+	availableMatches = messages.MessageField(MatchesMsg, 4)  # first page
+	accessToken      = messages.StringField(5)
+	syncVersion      = messages.StringField(6)  # pass to getChanges
+
+
+##############################################
+# Dashboard delta sync, and its messages
+##############################################
+class MatchChange(ndb.Model):
+	scopes   = ndb.StringProperty(repeated=True)  # 'u:<userId>' of players, 'b:<skill band>' of eligible partners
+	matchKey = ndb.StringProperty(indexed=False)  # urlsafe Match key, None if a Profile changed
+	version  = ndb.IntegerProperty(required=True)  # microseconds since epoch
+
+class SyncVersionMsg(messages.Message):
+	accessToken = messages.StringField(1)
+	version     = messages.StringField(2)  # from DashboardMsg.syncVersion or ChangesMsg.version
+
+# Matches in myMatches/availableMatches are added or updated, replacing any with the same key
+class ChangesMsg(messages.Message):
+	changed          = messages.BooleanField(1)  # False if nothing changed
+	reset            = messages.BooleanField(2)  # True if client must reload the dashboard
+	version          = messages.StringField(3)  # pass to next getChanges
+	myMatches        = messages.MessageField(MatchesMsg, 4)
+	availableMatches = messages.MessageField(MatchesMsg, 5)
+	removed          = messages.StringField(6, repeated=True)  # keys of matches to drop from all lists
+	accessToken      = messages.StringField(7)
+
+
+##############################################
+# Archive of a user's past matches, written by match_reminder_scrub
+##############################################
+class MatchHistory(ndb.Model):
+	# Key id is userId
+	# Compact entry per match: [urlsafe key, 'mm/dd/yyyy HH:MM', location, singles, confirmed, [userIds]]
+	matches = ndb.JsonProperty(compressed=True)
+
+
+##############################################
+# Messages posted by players in a match, and their messages
+##############################################
+class MatchMessage(ndb.Model):
+	# Parent is the Match key
+	userId = ndb.StringProperty(required=True)
+	name   = ndb.StringProperty(required=True, indexed=False)  # poster's 'firstName lastName' when posted
+	text   = ndb.TextProperty(required=True)
+	posted = ndb.DateTimeProperty(auto_now_add=True)
+
+class MatchMsgsPageMsg(messages.Message):
+	accessToken = messages.StringField(1)
+	matchKey    = messages.StringField(2)
+	cursor      = messages.StringField(3)  # empty for the first fetch
+
+# Each entry in 'data' is 'name|msg', same as StringArrayMsg from getMatchMsgs
+class MatchMsgsMsg(messages.Message):
+	data        = messages.StringField(1, repeated=True)
+	cursor      = messages.StringField(2)  # pass back to get only messages posted after these
+	more        = messages.BooleanField(3)  # True if more messages are already waiting
+	accessToken = messages.StringField(4)
+
+
+##############################################
+# Outbox of side effects written by transactions
+##############################################
+class Outbox(ndb.Model):
+	effects = ndb.JsonProperty(required=True)  # [[method name, [args]], ...], see TennisApi._dispatchOutbox
+	done    = ndb.IntegerProperty(default=0)  # number of effects already dispatched
+	created = ndb.DateTimeProperty(auto_now_add=True)
 
 
 ##############################################
@@ -0,0 +1,164 @@
+'''
+Open upcoming matches per skill band, materialized in memcache and per instance
+
+Each skill band has an index entry {'version', 'complete', 'matches'}. 'matches' are the band's
+open upcoming matches in openMatchOrder. 'complete' is False if there were more than
+OPEN_MATCHES_MAX of them, and then readers fall back to datastore queries.
+Entries are updated in place as matches change, see updateOpenMatches.
+In memcache, each match is just the fields that readers use, see _pack.
+'''
+
+from datetime import datetime
+from eastern_tzinfo import Eastern_tzinfo
+import logging
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Match
+
+OPEN_MATCHES_KEY = 'open_matches:%d'  # memcache, index entry of a skill band
+OPEN_MATCHES_VERSION_KEY = 'open_matches_version:%d'  # memcache, just the entry's version, cheap to check
+OPEN_MATCHES_TTL = 5 * 60  # seconds, bounds staleness if a rebuild races an update
+OPEN_MATCHES_LOCAL_TTL = 5  # seconds an instance trusts its own copy without checking the version
+OPEN_MATCHES_MAX = 500  # more open matches than this in a band, and the entry is incomplete
+OPEN_MATCHES_REBUILD_LOCK = 10  # seconds after a change that a band's entry can't be re-added, see updateOpenMatches
+
+_open_matches = {}  # skill band -> (index entry, time version was last checked)
+
+
+def _localNow():
+	""" Return current local time as naive datetime, comparable to Match.dateTime """
+	return datetime.now(Eastern_tzinfo()).replace(tzinfo=None)
+
+
+def _version():
+	""" Return new entry version, microseconds since epoch """
+	return int(time.time() * 1000000)
+
+
+def _pack(entry):
+	""" Return entry as stored in memcache, each match reduced to a tuple of the fields readers use """
+	matches = [(m.key.urlsafe(), m.dateTime, m.singles, m.location, list(m.players), m.confirmed, m.ntrp) for m in entry['matches']]
+	return dict(entry, matches=matches)
+
+
+def _unpack(value):
+	""" Return entry from its memcache value, with unsaved Match objects rebuilt from the stored fields """
+	if value is None:
+		return None
+
+	matches = []
+	for key, date_time, singles, location, players, confirmed, ntrp in value['matches']:
+		matches.append(Match(key=ndb.Key(urlsafe=key), dateTime=date_time, singles=singles, location=location,
+			players=players, confirmed=confirmed, ntrp=ntrp))
+	return dict(value, matches=matches)
+
+
+def _store(write, band, entry):
+	"""
+	Write entry of band with memcache write function (add, or a client's cas)
+	An entry too big for memcache is stored as incomplete and without matches, so readers query datastore instead.
+	Returns (write result, entry as stored)
+	"""
+	try:
+		return write(OPEN_MATCHES_KEY % band, _pack(entry), time=OPEN_MATCHES_TTL), entry
+	except ValueError:
+		logging.warning('Open match index of band %d is too big for memcache, marking it incomplete', band)
+		entry = dict(entry, complete=False, matches=[])
+		return write(OPEN_MATCHES_KEY % band, _pack(entry), time=OPEN_MATCHES_TTL), entry
+
+
+def openMatchOrder(match):
+	""" Sort key of matches in the open match index, earliest first """
+	return (match.dateTime, match.key.urlsafe())
+
+
+def openMatches(band):
+	""" Return open match index entry of skill band, from the instance's copy, memcache, or datastore """
+	now = time.time()
+
+	local = _open_matches.get(band)
+	if local is not None:
+		entry, checked = local
+		if checked + OPEN_MATCHES_LOCAL_TTL > now:
+			return entry
+
+		# Still current if nobody updated the band since
+		if memcache.get(OPEN_MATCHES_VERSION_KEY % band) == entry['version']:
+			_open_matches[band] = (entry, now)
+			return entry
+
+	entry = _unpack(memcache.get(OPEN_MATCHES_KEY % band))
+	if entry is None:
+		added, entry = _store(memcache.add, band, buildOpenMatches(band))
+		if added:
+			memcache.set(OPEN_MATCHES_VERSION_KEY % band, entry['version'], time=OPEN_MATCHES_TTL)
+
+	_open_matches[band] = (entry, now)
+	return entry
+
+
+def buildOpenMatches(band):
+	""" Build open match index entry of skill band from datastore """
+	query = Match.query(Match.skillBands == band, Match.full == False, Match.dateTime >= _localNow())
+	query = query.order(Match.dateTime)
+	matches = query.fetch(OPEN_MATCHES_MAX + 1)
+	matches.sort(key=openMatchOrder)
+
+	return {
+		'version':  _version(),
+		'complete': len(matches) <= OPEN_MATCHES_MAX,
+		'matches':  matches[:OPEN_MATCHES_MAX],
+	}
+
+
+def reindexOpenMatch(match, deleted=False):
+	""" Update open match index with changed match, once the transaction (if any) commits """
+	ndb.get_context().call_on_commit(lambda: updateOpenMatches([match], deleted))
+
+
+def updateOpenMatches(matches, deleted=False):
+	"""
+	Apply changed matches to the open match index of every skill band they're in
+	Open upcoming matches are added or replaced, full ones (or all, if deleted) are removed.
+	Bands not in memcache are left for the next reader to rebuild, but not right away: a rebuild already
+	running may have queried before this change was visible, so its memcache.add must fail.
+	"""
+	bands = {}
+	for match in matches:
+		for band in match.skillBands:
+			bands.setdefault(band, []).append(match)
+
+	client = memcache.Client()
+	now = _localNow()
+
+	for band, changed in bands.items():
+		changed_keys = set(match.key for match in changed)
+		_open_matches.pop(band, None)
+
+		for _ in range(10):
+			entry = _unpack(client.gets(OPEN_MATCHES_KEY % band))
+			if entry is None:
+				memcache.delete_multi([OPEN_MATCHES_KEY % band, OPEN_MATCHES_VERSION_KEY % band], seconds=OPEN_MATCHES_REBUILD_LOCK)
+				break
+
+			open_matches = [m for m in entry['matches'] if m.key not in changed_keys and m.dateTime >= now]
+			if not deleted:
+				open_matches += [m for m in changed if not m.full and m.dateTime >= now]
+			open_matches.sort(key=openMatchOrder)
+
+			entry = {
+				'version':  _version(),
+				'complete': entry['complete'] and len(open_matches) <= OPEN_MATCHES_MAX,
+				'matches':  open_matches[:OPEN_MATCHES_MAX],
+			}
+			stored, entry = _store(client.cas, band, entry)
+			if stored:
+				memcache.set(OPEN_MATCHES_VERSION_KEY % band, entry['version'], time=OPEN_MATCHES_TTL)
+				_open_matches[band] = (entry, time.time())
+				break
+		else:
+			# Too contended, drop it so a reader rebuilds it once the lock is up
+			memcache.delete_multi([OPEN_MATCHES_KEY % band, OPEN_MATCHES_VERSION_KEY % band], seconds=OPEN_MATCHES_REBUILD_LOCK)
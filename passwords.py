@@ -0,0 +1,89 @@
+'''
+Password hashing for custom accounts, using native PBKDF2 (hashlib.pbkdf2_hmac)
+
+Stored hashes are versioned: 'pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>'
+Legacy hashes are 'salt hex|hash hex', from PyCrypto's KDF.PBKDF2 defaults
+(HMAC-SHA1, 1000 iterations, 16 byte key). They still verify, and needsRehash()
+tells the caller to upgrade them on the next successful login.
+
+Hashing is CPU bound, so at most MAX_CONCURRENT hashes run at once per instance.
+Callers that can't get a slot within WAIT_TIMEOUT get BusyError instead of piling up.
+
+ITERATIONS is sized against the legacy hash, which took about 10 ms in PyCrypto's pure Python
+loop: with OpenSSL's pbkdf2_hmac, 10000 rounds of HMAC-SHA256 take about 5 ms. hashlib falls back
+to a pure Python pbkdf2_hmac when it isn't built against OpenSSL, which is several times slower,
+so that is logged as an error on import.
+'''
+
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+
+ALGORITHM = 'pbkdf2_sha256'
+ITERATIONS = 10000  # raising this upgrades existing hashes on their next login
+SALT_SIZE = 16  # bytes
+
+# PyCrypto KDF.PBKDF2 defaults, used by legacy 'salt|passkey' hashes
+LEGACY_ITERATIONS = 1000
+LEGACY_KEY_SIZE = 16  # bytes
+
+MAX_CONCURRENT = 4  # hashes running at once per instance
+WAIT_TIMEOUT = 5  # seconds to wait for a free slot
+
+_slots = threading.BoundedSemaphore(MAX_CONCURRENT)
+
+if hashlib.pbkdf2_hmac.__module__ != '_hashlib':
+	logging.error('hashlib.pbkdf2_hmac is not the OpenSSL version, password hashing will be slow')
+
+
+class BusyError(Exception):
+	""" Too many passwords are being hashed on this instance, try again later """
+	pass
+
+
+def _pbkdf2(digest, password, salt, iterations, key_size=None):
+	""" Run hashlib.pbkdf2_hmac once a slot is free, see MAX_CONCURRENT """
+	deadline = time.time() + WAIT_TIMEOUT
+	while not _slots.acquire(False):
+		if time.time() > deadline:
+			raise BusyError()
+		time.sleep(0.01)
+
+	try:
+		if isinstance(password, unicode):
+			password = password.encode('utf-8')
+		return hashlib.pbkdf2_hmac(digest, password, salt, iterations, key_size)
+	finally:
+		_slots.release()
+
+
+def hashPassword(password):
+	""" Return versioned hash string of password, with a new random salt """
+	salt = os.urandom(SALT_SIZE)
+	passkey = _pbkdf2('sha256', password, salt, ITERATIONS)
+	return '%s$%d$%s$%s' % (ALGORITHM, ITERATIONS, salt.encode('hex'), passkey.encode('hex'))
+
+
+def verifyPassword(password, stored):
+	""" Return True if password matches stored hash (versioned or legacy) """
+	if '$' in stored:
+		algorithm, iterations, salt, passkey = stored.split('$')
+		if algorithm != ALGORITHM:
+			return False
+		computed = _pbkdf2('sha256', password, salt.decode('hex'), int(iterations))
+	elif '|' in stored:
+		salt, passkey = stored.split('|')
+		computed = _pbkdf2('sha1', password, salt.decode('hex'), LEGACY_ITERATIONS, LEGACY_KEY_SIZE)
+	else:
+		return False
+
+	return hmac.compare_digest(computed.encode('hex'), str(passkey))
+
+
+def needsRehash(stored):
+	""" Return True if stored hash is legacy or weaker than current settings """
+	parts = stored.split('$')
+	return len(parts) != 4 or parts[0] != ALGORITHM or int(parts[1]) != ITERATIONS
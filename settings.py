@@ -13,3 +13,21 @@ GRECAPTCHA_SECRET = 'secret'
 
 # Sparkpost
 SPARKPOST_SECRET = 'secret'
+SPARKPOST_API_URL = 'https://api.sparkpost.com/api/v1'  # point at a local fake server for testing
+SPARKPOST_BATCH_SIZE = 100  # max recipients per bulk transmission
+
+# Match-making
+SKILL_TOLERANCE = 0.5  # max difference in normalized NTRP between partners
+SKILL_BAND_WIDTH = 0.25  # granularity of Match.skillBands, see models.py
+AVAILABLE_MATCHES_INBOX = False  # fan out new matches to each eligible partner's AvailableMatch inbox on write, see main.py
+
+# Dashboard delta sync
+SYNC_RETENTION = 24 * 60 * 60 * 1000000  # microseconds, clients older than this must reload the dashboard
+
+# Match recommendations, see TennisApi.getRecommendedMatches
+# Each term scores a match from 0 (worst) to 1 (best), the weights set how much each counts
+RECOMMEND_SKILL_WEIGHT = 4.0  # closeness of owner's normalized NTRP to the player's
+RECOMMEND_TIME_WEIGHT = 2.0  # how soon the match is
+RECOMMEND_TYPE_WEIGHT = 1.0  # singles/doubles as the player asked for
+RECOMMEND_FULLNESS_WEIGHT = 1.0  # how few open spots are left
+RECOMMEND_TIME_SCALE = 3 * 24  # hours, a match this far out gets half the time score